@@ -0,0 +1,66 @@
+import io
+import lzma
+import tarfile
+import zipfile
+import zlib
+from typing import List, Tuple
+
+
+def is_clip_name(name: str) -> bool:
+    """Skip directories and hidden or metadata files (e.g. `__MACOSX/`, `.DS_Store`) in archives."""
+    parts = name.replace("\\", "/").split("/")
+    return bool(parts[-1]) and not any(part.startswith((".", "__MACOSX")) for part in parts)
+
+
+class ClipBudget:
+    """Checks the unpacked size of every clip, and of all of them together, before it is read."""
+
+    def __init__(self, max_clips: int, max_clip_bytes: int, max_total_bytes: int):
+        self.max_clips = max_clips
+        self.max_clip_bytes = max_clip_bytes
+        self.max_total_bytes = max_total_bytes
+        self.num_clips = 0
+        self.total_bytes = 0
+
+    def admit(self, name: str, size: int):
+        if self.num_clips == self.max_clips:
+            raise ValueError(f"archive holds more than {self.max_clips} clips")
+        if size > self.max_clip_bytes:
+            raise ValueError(f"{name} is larger than {self.max_clip_bytes} bytes unpacked")
+        if self.total_bytes + size > self.max_total_bytes:
+            raise ValueError(f"clips are larger than {self.max_total_bytes} bytes unpacked")
+        self.num_clips += 1
+        self.total_bytes += size
+
+
+def read_archive(data: bytes, max_clips: int, max_clip_bytes: int, max_total_bytes: int) -> List[Tuple[str, bytes]]:
+    """Unpack the clips of a zip or tar (optionally compressed) archive as (name, content) pairs.
+
+    Sizes are checked against the limits before a clip is unpacked, so a small
+    archive cannot expand into more memory than `max_total_bytes`. Raises
+    ValueError if `data` is not an archive, is corrupt or exceeds a limit.
+    """
+    budget = ClipBudget(max_clips, max_clip_bytes, max_total_bytes)
+    clips = []
+    try:
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not is_clip_name(info.filename):
+                        continue
+                    # reading stops at the declared size, so the check also holds for a forged header
+                    budget.admit(info.filename, info.file_size)
+                    clips.append((info.filename, archive.read(info)))
+            return clips
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as archive:
+            for member in archive:
+                if not member.isfile() or not is_clip_name(member.name):
+                    continue
+                budget.admit(member.name, member.size)
+                clips.append((member.name, archive.extractfile(member).read()))
+    except tarfile.TarError as e:
+        raise ValueError("not a zip or tar archive") from e
+    except (zipfile.BadZipFile, zlib.error, lzma.LZMAError, EOFError, OSError) as e:
+        # corrupt or truncated member
+        raise ValueError(f"corrupt archive: {e}") from e
+    return clips
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+# entry fields that are not arrays are stored as JSON in this array of the .npz file
+JSON_FIELD = "__json__"
+
+
+def content_digest(content: bytes) -> str:
+    """SHA-256 of an uploaded payload."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def entry_size(entry: Dict[str, Any]) -> int:
+    """Approximate memory footprint of a cache entry in bytes."""
+    return sum(value.nbytes if hasattr(value, "nbytes") else len(str(value)) for value in entry.values())
+
+
+class ResultCache:
+    """Content-addressed cache of pipeline results.
+
+    Entries are dicts (transcripts, corrections and optionally landmark / mouth ROI
+    arrays) keyed by `fingerprint-digest`, where the fingerprint identifies the
+    model or preprocessing configuration that produced them. Entries live in a
+    memory tier bounded by `max_bytes` with LRU eviction and, when `disk_dir` is
+    set, in an on-disk tier bounded by `disk_max_bytes` that survives restarts.
+    On disk an entry is a `.npz` file of its arrays plus its other fields as
+    JSON, loaded without pickle. Lookups of intermediates are counted apart from
+    lookups of results. All methods are meant to be awaited from the event
+    loop; disk I/O runs in a thread.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 0, store_intermediates: bool = False):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.store_intermediates = store_intermediates
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.intermediate_hits = 0
+        self.intermediate_misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(digest: str, fingerprint: str) -> str:
+        return f"{fingerprint}-{digest}"
+
+    async def get(self, key: str, intermediate: bool = False) -> Optional[Dict[str, Any]]:
+        """Return the entry for `key`, promoting disk hits into memory."""
+        entry = self.entries.get(key)
+        if entry is None and self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                self._put_memory(key, entry)
+        if entry is None:
+            if intermediate:
+                self.intermediate_misses += 1
+            else:
+                self.misses += 1
+            return None
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        if intermediate:
+            self.intermediate_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def put(self, key: str, entry: Dict[str, Any]):
+        """Store `entry` under `key` in memory and, if enabled, on disk."""
+        self._put_memory(key, entry)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "intermediate_hits": self.intermediate_hits,
+            "intermediate_misses": self.intermediate_misses,
+        }
+
+    def _put_memory(self, key: str, entry: Dict[str, Any]):
+        size = entry_size(entry)
+        if key in self.entries:
+            self.total_bytes -= self.sizes.pop(key)
+            del self.entries[key]
+        if size > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.sizes[key] = size
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            old_key, _ = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(old_key)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.npz")
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            # no pickle, so a file planted in the cache directory cannot run code
+            with np.load(path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files if name != JSON_FIELD}
+                entry.update(json.loads(data[JSON_FIELD].tobytes().decode()))
+            # refresh the mtime so disk eviction stays least-recently-used
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Dropping unreadable cache entry {path}: {e}", flush=True)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            arrays = {name: value for name, value in entry.items() if isinstance(value, np.ndarray)}
+            fields = {name: value for name, value in entry.items() if name not in arrays}
+            # a temporary file of its own, so concurrent writers of the same key never share one
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, prefix=f"{key}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays, **{JSON_FIELD: np.frombuffer(json.dumps(fields).encode(), dtype=np.uint8)})
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Failed to write cache entry {path}: {e}", flush=True)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        with os.scandir(self.disk_dir) as it:
+            for item in it:
+                if item.name.endswith(".npz"):
+                    stat = item.stat()
+                    files.append((stat.st_mtime, stat.st_size, item.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
@@ -14,53 +14,152 @@ if str(root_dir) not in sys.path:
 os.chdir(root_dir)
 
 import asyncio
-import tempfile
-from typing import Optional
+import hashlib
+import queue
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 import torch
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import Depends, FastAPI, File, Header, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
 from silencevoice import SilenceVoiceOutput
+from correction_cache import CorrectionCache
 from pipelines.pipeline import InferencePipeline
+from pipelines.data.arrays import load_roi_array
+from pipelines.data.landmarks import load_landmarks
+from pipelines.profiler import SampledProfiler
+from backend.bulk import read_archive
+from backend.cache import ResultCache, content_digest
+from backend.metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, Counter, Gauge, observe_trace
+from backend.registry import LoadedModel, ModelRegistry
+from backend.scheduler import BatchScheduler, DeadlineExceededError, QueueFullError, traced
+from backend.tracing import log, new_trace_id, observe_stage, server_timing_header, stage_timings_var, trace_id_var
+from pipelines import timing
 
 
 class TranscriptionResponse(BaseModel):
     raw_output: str
     corrected_text: str
     list_of_changes: str
+    # per-stage breakdown in milliseconds, only when requested with ?timings=true
+    timings_ms: Optional[Dict[str, float]] = None
 
 
 from contextlib import asynccontextmanager
 
+# Model served when a request does not pick one with ?model=<config name>
+DEFAULT_MODEL = os.getenv("VSR_DEFAULT_MODEL", "LRS3_V_WER19.1")
+NUM_WORKERS = int(os.getenv("VSR_NUM_WORKERS", "2"))
+MAX_QUEUE_SIZE = int(os.getenv("VSR_MAX_QUEUE_SIZE", "32"))
+# Samples model calls of every pipeline; adjustable at runtime via /admin/profiler
+profiler = SampledProfiler(
+    sample_rate=float(os.getenv("VSR_PROFILE_SAMPLE_RATE", "0")),
+    trace_dir=os.getenv("VSR_PROFILE_DIR", str(root_dir / "profiles")),
+    max_bytes=int(float(os.getenv("VSR_PROFILE_MAX_MB", "200")) * 1024 * 1024),
+)
+
+
+def build_pipeline(config_filename: str, device=None, eager_detector=True) -> InferencePipeline:
+    """Load the VSR pipeline of a config file."""
+    if device is None:
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    pipeline = InferencePipeline(
+        config_filename,
+        device=device,
+        detector="mediapipe",
+        face_track=True,
+        eager_detector=eager_detector,
+    )
+    pipeline.model.profiler = profiler
+    return pipeline
+
+
+def load_model(device=None, eager_detector=True):
+    """Load the default VSR model into `preloaded_model` before the server starts."""
+    global preloaded_model
+    
+    print(f"Loading VSR model {DEFAULT_MODEL}...")
+    try:
+        preloaded_model = build_pipeline(str(root_dir / "configs" / f"{DEFAULT_MODEL}.ini"), device, eager_detector)
+        print("✅ VSR Model loaded successfully!")
+    except Exception as e:
+        print(f"❌ Failed to load VSR model: {e}")
+
+
+def make_scheduler(pipeline: InferencePipeline) -> BatchScheduler:
+    # every model batches its own requests, the preprocessing threads (and their detectors) are shared
+    return BatchScheduler(
+        pipeline,
+        max_batch_size=int(os.getenv("VSR_MAX_BATCH_SIZE", "8")),
+        max_wait_ms=float(os.getenv("VSR_MAX_WAIT_MS", "20")),
+        num_workers=NUM_WORKERS,
+        max_queue_size=MAX_QUEUE_SIZE,
+        timeout=float(os.getenv("VSR_REQUEST_TIMEOUT_S", "30")),
+        preprocess_executor=preprocess_executor,
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Load the VSR model at startup to avoid reloading for each request."""
-    global vsr_model
-    
-    config_filename = str(root_dir / "configs" / "LRS3_V_WER19.1.ini")
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    global registry, preprocess_executor, result_cache, live_executor, warmup_task, bulk_slots
     
-    print(f"Loading VSR model on {device}...")
+    # bulk clips of all jobs together stay below the admission limit, so interactive requests are
+    # admitted even while bulk jobs wait for free slots
+    bulk_slots = asyncio.Semaphore(max(1, min(BULK_MAX_IN_FLIGHT, MAX_QUEUE_SIZE - 1)))
+    preprocess_executor = ThreadPoolExecutor(max_workers=NUM_WORKERS, thread_name_prefix="vsr-preprocess")
+    # each live session keeps one thread busy with detection and cropping while frames arrive
+    live_executor = ThreadPoolExecutor(max_workers=MAX_LIVE_SESSIONS, thread_name_prefix="vsr-live")
+    registry = ModelRegistry(
+        str(root_dir / "configs"),
+        load=build_pipeline,
+        make_scheduler=make_scheduler,
+        max_bytes=int(float(os.getenv("VSR_MODEL_MEMORY_MB", "0")) * 1024 * 1024),
+        pinned=[DEFAULT_MODEL],
+    )
     try:
-        vsr_model = InferencePipeline(
-            config_filename,
-            device=device,
-            detector="mediapipe",
-            face_track=True
-        )
-        print("✅ VSR Model loaded successfully!")
+        # a pre-forking parent (backend/serve.py) has already loaded the model for all workers
+        if preloaded_model is not None:
+            await registry.add(DEFAULT_MODEL, preloaded_model)
+        else:
+            await registry.release(await registry.acquire(DEFAULT_MODEL))
     except Exception as e:
         print(f"❌ Failed to load VSR model: {e}")
+
+    if DEFAULT_MODEL in registry.models:
+        # warm up in the background so /health answers while /ready still reports not ready
+        warmup_task = asyncio.create_task(warmup_model(registry.models[DEFAULT_MODEL]))
+
+    cache_mb = float(os.getenv("VSR_CACHE_MAX_MB", "256"))
+    if cache_mb > 0:
+        result_cache = ResultCache(
+            max_bytes=int(cache_mb * 1024 * 1024),
+            disk_dir=os.getenv("VSR_CACHE_DIR") or None,
+            disk_max_bytes=int(float(os.getenv("VSR_CACHE_DISK_MAX_MB", "2048")) * 1024 * 1024),
+            store_intermediates=os.getenv("VSR_CACHE_INTERMEDIATES", "0") == "1",
+        )
         
     yield
     # Clean up if needed
     print("Shutting down...")
+    if warmup_task:
+        warmup_task.cancel()
+    await registry.stop()
+    for executor in (preprocess_executor, live_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
 
 app = FastAPI(title="SilenceVoice VSR API", version="1.0.0", lifespan=lifespan)
 
+# Server-Timing goes on every response with VSR_SERVER_TIMING=1, otherwise only on requests with ?timings=true
+SERVER_TIMING = os.getenv("VSR_SERVER_TIMING", "0") == "1"
+# Origins whose pages may read the timings (Timing-Allow-Origin), none by default
+TIMING_ALLOW_ORIGIN = os.getenv("VSR_TIMING_ALLOW_ORIGIN")
+
 @app.get("/")
 async def root():
     """Root endpoint to verify backend is running."""
@@ -73,13 +172,59 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """Tag the request with a trace ID, report its stage timings and record request metrics."""
+    start_time = time.perf_counter()
+    trace_id = new_trace_id(request.headers.get("x-request-id"))
+    trace_id_var.set(trace_id)
+    timings = {}
+    stage_timings_var.set(timings)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = trace_id
+        if SERVER_TIMING or request.query_params.get("timings", "").lower() in ("1", "true", "yes", "on"):
+            # streaming responses only carry the stages finished before the body started
+            response.headers["Server-Timing"] = server_timing_header(timings, time.perf_counter() - start_time)
+            if TIMING_ALLOW_ORIGIN:
+                response.headers["Timing-Allow-Origin"] = TIMING_ALLOW_ORIGIN
+        return response
+    finally:
+        route = request.scope.get("route")
+        # label by route template so unknown paths do not create new series
+        endpoint = route.path if route else "other"
+        REQUESTS.inc(endpoint=endpoint, status=str(status))
+        REQUEST_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint)
+
 from google import genai
 from google.genai import types
 
-# Global VSR model instance (loaded once at startup)
-vsr_model: Optional[InferencePipeline] = None
+# Default VSR model loaded before startup, e.g. once for all pre-forked workers
+preloaded_model: Optional[InferencePipeline] = None
+# VSR models by config name, each with a micro-batching scheduler in front of it
+registry: Optional[ModelRegistry] = None
+# Threads decoding and cropping uploads, shared by all models
+preprocess_executor: Optional[ThreadPoolExecutor] = None
+# Content-addressed cache of results for repeated uploads
+result_cache: Optional[ResultCache] = None
+# Set once the model has been warmed up and can serve requests at full speed
+model_ready = False
+warmup_task: Optional[asyncio.Task] = None
+# Synthetic clip lengths (in frames) decoded at startup; empty skips the model warmup
+WARMUP_LENGTHS = [int(length) for length in os.getenv("VSR_WARMUP_LENGTHS", "25,75,150").split(",") if length.strip()]
+# Threads running the preprocessing of live WebSocket sessions
+live_executor: Optional[ThreadPoolExecutor] = None
+live_sessions = 0
+MAX_LIVE_SESSIONS = int(os.getenv("VSR_MAX_LIVE_SESSIONS", "4"))
+LIVE_PARTIAL_INTERVAL = float(os.getenv("VSR_LIVE_PARTIAL_INTERVAL_S", "1.0"))
+# Partials only encode the latest frames, so their cost does not grow with the utterance
+LIVE_PARTIAL_MAX_FRAMES = int(os.getenv("VSR_LIVE_PARTIAL_MAX_FRAMES", "125"))
 
 # Configure Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -89,6 +234,22 @@ else:
     print("⚠️ GEMINI_API_KEY not found in environment variables")
     client = None
 
+GEMINI_MODEL = "gemini-3-flash-preview"
+CORRECTION_PROMPT = (
+    "You are an assistant that helps make corrections to the output of a lipreading model. "
+    "Return the corrected text in a JSON format with 'list_of_changes' and 'corrected_text' keys. "
+    "Example JSON: {\"list_of_changes\": \"Fixed spelling\", \"corrected_text\": \"Hello world.\"}\n\n"
+    "Transcription to fix:\n\n"
+)
+# Cached corrections are only reused for the same prompt and model
+CORRECTION_PROMPT_VERSION = hashlib.sha256((GEMINI_MODEL + CORRECTION_PROMPT).encode()).hexdigest()[:8]
+
+# Cache of corrections for transcripts we have already sent to Gemini
+correction_cache = CorrectionCache(
+    max_entries=int(os.getenv("CORRECTION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CORRECTION_CACHE_TTL_S", "86400")),
+)
+
 
 
 
@@ -103,26 +264,31 @@ class SilenceVoiceOutput(BaseModel):
 import time
 
 async def correct_output_async(output: str) -> dict:
+    """Correct the raw VSR output, reusing cached and in-flight corrections of the same text."""
+    key = CorrectionCache.make_key(output, CORRECTION_PROMPT_VERSION)
+    start_time = time.perf_counter()
+    result = await correction_cache.get_or_compute(
+        key, lambda: request_correction(output), cacheable=lambda result: result["success"])
+    observe_stage("correct", time.perf_counter() - start_time)
+    return result
+
+
+async def request_correction(output: str) -> dict:
     """Use Gemini to correct the raw VSR output with manual parsing for robustness."""
-    print(f"🤖 Starting LLM correction for: '{output}'", flush=True)
+    log(f"🤖 Starting LLM correction for: '{output}'")
     start_time = time.time()
     
     try:
         if not client:
             raise Exception("Gemini client not configured. Please set GEMINI_API_KEY.")
 
-        prompt = (
-            "You are an assistant that helps make corrections to the output of a lipreading model. "
-            "Return the corrected text in a JSON format with 'list_of_changes' and 'corrected_text' keys. "
-            "Example JSON: {\"list_of_changes\": \"Fixed spelling\", \"corrected_text\": \"Hello world.\"}\n\n"
-            f"Transcription to fix:\n\n{output}"
-        )
+        prompt = CORRECTION_PROMPT + output
 
         # Wrap the Gemini call with a timeout
         response = await asyncio.wait_for(
             asyncio.to_thread(
                 client.models.generate_content,
-                model='gemini-3-flash-preview',
+                model=GEMINI_MODEL,
                 contents=prompt,
                 config=types.GenerateContentConfig(
                     max_output_tokens=150,
@@ -135,10 +301,10 @@ async def correct_output_async(output: str) -> dict:
         # Parse the content
         content = response.text
         if not content:
-            print("⚠️ LLM returned empty response", flush=True)
+            log("⚠️ LLM returned empty response")
             raise ValueError("Empty response from LLM")
             
-        print(f"DEBUG: LLM Response: {content}", flush=True)
+        log(f"DEBUG: LLM Response: {content}")
         
         # Clean markdown if present
         if content.startswith("```"):
@@ -155,48 +321,142 @@ async def correct_output_async(output: str) -> dict:
             
         end_time = time.time()
         duration = end_time - start_time
-        print(f"✅ LLM Correction successful in {duration:.2f} seconds", flush=True)
+        log(f"✅ LLM Correction successful in {duration:.2f} seconds")
         
         return {
             "corrected_text": corrected_text,
-            "list_of_changes": data.get('list_of_changes', "Standard correction")
+            "list_of_changes": data.get('list_of_changes', "Standard correction"),
+            "success": True
         }
     except asyncio.TimeoutError:
         end_time = time.time()
         duration = end_time - start_time
-        print(f"⚠️ LLM Correction timed out after {duration:.2f} seconds", flush=True)
+        log(f"⚠️ LLM Correction timed out after {duration:.2f} seconds")
         return {
             "corrected_text": output.capitalize() + ".",
-            "list_of_changes": "LLM timeout, used raw output"
+            "list_of_changes": "LLM timeout, used raw output",
+            "success": False
         }
     except Exception as e:
         end_time = time.time()
         duration = end_time - start_time
-        print(f"⚠️ LLM Correction failed after {duration:.2f} seconds: {str(e)}", flush=True)
+        log(f"⚠️ LLM Correction failed after {duration:.2f} seconds: {str(e)}")
         return {
             "corrected_text": output.capitalize() + ".",
-            "list_of_changes": "LLM unavailable, used raw output"
+            "list_of_changes": "LLM unavailable, used raw output",
+            "success": False
         }
 
-@app.post("/process-video", response_model=TranscriptionResponse)
-async def process_video(video: UploadFile = File(...)):
-    """Process a video file and return the transcribed text."""
-    if not vsr_model:
+async def acquire_model(name: Optional[str]) -> LoadedModel:
+    """Lease the requested model (the default one if not given), loading it if needed."""
+    name = name or DEFAULT_MODEL
+    if registry is None:
         raise HTTPException(status_code=503, detail="VSR model not loaded")
-    
-    # Save uploaded file to temporary location
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-        content = await video.read()
-        tmp_file.write(content)
-        tmp_path = tmp_file.name
+    try:
+        return await registry.acquire(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model {name}, see /models")
+    except Exception as e:
+        log(f"❌ Failed to load VSR model {name}: {str(e)}")
+        raise HTTPException(status_code=503, detail="VSR model not loaded")
+
+
+async def read_upload(vsr: LoadedModel, video: UploadFile, landmarks: Optional[UploadFile]):
+    """Read an uploaded clip and its optional landmarks, returning (content, landmarks, digest)."""
+    # Keep the upload in memory; it is decoded straight from the buffer
+    start_time = time.perf_counter()
+    content = await video.read()
+    observe_stage("read", time.perf_counter() - start_time)
+    digest = await upload_digest(content)
+    if landmarks is None:
+        return content, None, digest
+    landmarks_data = await landmarks.read()
+    try:
+        parsed = await asyncio.to_thread(load_landmarks, landmarks_data, vsr.pipeline.num_landmarks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid landmarks: {e}")
+    # the transcript depends on the landmarks as well as the clip
+    if digest:
+        digest = content_digest(digest.encode() + landmarks_data)
+    return content, parsed, digest
+
+
+async def upload_digest(content: bytes) -> Optional[str]:
+    """Hash of an upload for the result cache, None without a cache."""
+    if not result_cache:
+        return None
+    return await asyncio.to_thread(content_digest, content)
+
+
+async def run_vsr(vsr: LoadedModel, content: bytes, digest: Optional[str], on_partial=None, landmarks=None, block=False) -> str:
+    """Transcribe an uploaded clip, reusing cached landmarks and mouth ROI when available."""
+    pipeline, scheduler = vsr.pipeline, vsr.scheduler
+    if not (result_cache and result_cache.store_intermediates):
+        return await scheduler.submit(pipeline.load_data, content, landmarks, on_partial=on_partial, block=block)
+
+    roi_key = ResultCache.make_key(digest, pipeline.preprocess_fingerprint)
+    intermediates = await result_cache.get(roi_key, intermediate=True)
+    if intermediates:
+        log(f"⚡ Mouth ROI cache hit for {digest[:12]}")
+        return await scheduler.submit(pipeline.load_roi, intermediates["roi"], on_partial=on_partial, block=block)
+
+    intermediates = {}
+    raw_output = await scheduler.submit(pipeline.load_data, content, landmarks, intermediates,
+                                        on_partial=on_partial, block=block)
+    if intermediates:
+        await result_cache.put(roi_key, intermediates)
+    return raw_output
+
+
+async def cache_result(cache_key: str, raw_output: str, correction_data: dict):
+    """Store a transcript and, if the LLM succeeded, its correction in the result cache."""
+    if not result_cache:
+        return
+    # fallback corrections are not cached so a retry gets another chance at the LLM
+    entry = {"raw_output": raw_output}
+    if correction_data["success"]:
+        entry["corrected_text"] = correction_data["corrected_text"]
+        entry["list_of_changes"] = correction_data["list_of_changes"]
+    await result_cache.put(cache_key, entry)
+
+
+def with_timings(response: TranscriptionResponse, timings: bool) -> TranscriptionResponse:
+    if timings:
+        response.timings_ms = {name: round(seconds * 1000, 1) for name, seconds in (stage_timings_var.get() or {}).items()}
+    return response
+
+
+async def transcribe(cache_key: str, digest: Optional[str], run, swallow_errors: bool = True) -> TranscriptionResponse:
+    """Answer from the result cache or transcribe with `run()` and correct the transcript.
+
+    Unexpected errors are answered with an apology instead of an error status so
+    the frontend does not hang; with `swallow_errors` off they are raised instead.
+    """
+    cached = await result_cache.get(cache_key) if result_cache else None
+    if cached and "corrected_text" in cached:
+        log(f"⚡ Result cache hit for {digest[:12]}")
+        return TranscriptionResponse(**cached)
     
     try:
-        # Perform VSR inference
-        raw_output = vsr_model(tmp_path)
-        print(f"Raw VSR Output: {raw_output}", flush=True)
+        if cached:
+            raw_output = cached["raw_output"]
+        else:
+            # Preprocess on the worker pool, then batch the model pass with concurrent requests
+            try:
+                raw_output = await run()
+            except QueueFullError:
+                raise HTTPException(status_code=429, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+            except DeadlineExceededError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            except ValueError as e:
+                # undecodable clip or landmarks that do not match it
+                raise HTTPException(status_code=400, detail=str(e))
+        log(f"Raw VSR Output: {raw_output}")
         
         # Get correction (this function now handles its own errors)
         correction_data = await correct_output_async(raw_output)
+
+        await cache_result(cache_key, raw_output, correction_data)
         
         return TranscriptionResponse(
             raw_output=raw_output,
@@ -204,19 +464,512 @@ async def process_video(video: UploadFile = File(...)):
             list_of_changes=correction_data["list_of_changes"]
         )
     
+    except HTTPException:
+        raise
+
     except Exception as e:
-        print(f"❌ Critical Processing error: {str(e)}", flush=True)
+        log(f"❌ Critical Processing error: {str(e)}")
+        if not swallow_errors:
+            raise
         # Even on critical error, try to return something so the frontend doesn't hang
         return TranscriptionResponse(
             raw_output="Error",
             corrected_text="I'm sorry, there was an error processing the video.",
             list_of_changes=str(e)
         )
-    
+
+
+@app.post("/process-video", response_model=TranscriptionResponse, response_model_exclude_none=True)
+async def process_video(video: UploadFile = File(...), landmarks: Optional[UploadFile] = File(None),
+                        timings: bool = False, model: Optional[str] = None):
+    """Process a video file and return the transcribed text.
+
+    `landmarks` optionally carries face landmarks computed by the client, which
+    skips face detection on the server (see `load_landmarks` for the format).
+    With `?timings=true` the response includes a per-stage latency breakdown,
+    and `?model=<name>` picks another model than the default (see /models).
+    """
+    vsr = await acquire_model(model)
+    try:
+        content, landmarks, digest = await read_upload(vsr, video, landmarks)
+        cache_key = ResultCache.make_key(digest, vsr.pipeline.fingerprint)
+        response = await transcribe(cache_key, digest, lambda: run_vsr(vsr, content, digest, landmarks=landmarks))
+        return with_timings(response, timings)
+    finally:
+        await registry.release(vsr)
+
+
+@app.post("/process-roi", response_model=TranscriptionResponse, response_model_exclude_none=True)
+async def process_roi(roi: UploadFile = File(...), timings: bool = False, model: Optional[str] = None):
+    """Transcribe mouth ROI frames that were already cropped by the client.
+
+    `roi` is a `.npy` file (or an `.npz` with a `roi` entry) holding a uint8
+    (frames, 96, 96) or (frames, 88, 88) grayscale array at the configured
+    input frame rate. Decoding, face detection and cropping are skipped.
+    `?timings=true` adds a per-stage latency breakdown to the response.
+    """
+    vsr = await acquire_model(model)
+    try:
+        if vsr.pipeline.modality != "video":
+            raise HTTPException(status_code=400, detail="Mouth ROI uploads need a video-only model")
+
+        content = await roi.read()
+        digest = await upload_digest(content)
+        try:
+            roi_array = await asyncio.to_thread(load_roi_array, content)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid mouth ROI: {e}")
+        cache_key = ResultCache.make_key(digest, vsr.pipeline.fingerprint)
+        response = await transcribe(cache_key, digest, lambda: vsr.scheduler.submit(vsr.pipeline.load_roi, roi_array))
+        return with_timings(response, timings)
+    finally:
+        await registry.release(vsr)
+
+
+BULK_MAX_CLIPS = int(os.getenv("VSR_BULK_MAX_CLIPS", "1000"))
+# every clip of a bulk job is held in memory until it is processed
+BULK_MAX_CLIP_BYTES = int(float(os.getenv("VSR_BULK_MAX_CLIP_MB", "100")) * 1024 * 1024)
+BULK_MAX_BYTES = int(float(os.getenv("VSR_BULK_MAX_MB", "1024")) * 1024 * 1024)
+BULK_CONCURRENCY = int(os.getenv("VSR_BULK_CONCURRENCY", "8"))
+BULK_MAX_IN_FLIGHT = int(os.getenv("VSR_BULK_MAX_IN_FLIGHT", "16"))
+# Clips of all bulk jobs in the pipeline at once, shared by the jobs
+bulk_slots: Optional[asyncio.Semaphore] = None
+
+
+async def stream_bulk_results(vsr: LoadedModel, clips: List[tuple]):
+    """Transcribe (name, content) clips concurrently and yield an NDJSON line per clip as it finishes."""
+    # a bounded number of clips per job is in the pipeline at once, enough to fill batches, and
+    # all jobs share `bulk_slots`, which leaves room in the admission queue for interactive requests
+    slots = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def process_clip(index: int, name: str, content: bytes) -> dict:
+        # each clip runs in its own task, so it gets its own trace ID and timings
+        trace_id_var.set(f"{trace_id_var.get()}-{index}")
+        stage_timings_var.set({})
+        async with slots, bulk_slots:
+            digest = await upload_digest(content)
+            cache_key = ResultCache.make_key(digest, vsr.pipeline.fingerprint)
+            try:
+                response = await transcribe(cache_key, digest, lambda: run_vsr(vsr, content, digest, block=True),
+                                            swallow_errors=False)
+            except HTTPException as e:
+                return {"event": "error", "index": index, "name": name, "detail": e.detail}
+            except Exception as e:
+                # e.g. no face found in the clip
+                return {"event": "error", "index": index, "name": name, "detail": str(e)}
+            return {"event": "result", "index": index, "name": name, **response.model_dump()}
+
+    tasks = [asyncio.create_task(process_clip(index, name, content)) for index, (name, content) in enumerate(clips)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            yield json.dumps(result) + "\n"
+        yield stream_event("done", count=len(tasks))
+    finally:
+        # stop the remaining clips if the client went away
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/process-videos")
+async def process_videos(videos: List[UploadFile] = File(None), archive: Optional[UploadFile] = File(None),
+                         model: Optional[str] = None):
+    """Transcribe many clips in one request and stream the results back as they finish.
+
+    Clips are uploaded either as repeated `videos` form fields or as one zip or
+    tar `archive`. The response is newline-delimited JSON with one `result` (or
+    `error`) line per clip, in completion order and tagged with the clip's index
+    and name, followed by a final `done` line. Clips are preprocessed in parallel
+    and batched through the model together; when the server is busy they wait
+    for admission instead of being rejected.
+    """
+    clips = []
+    total_bytes = 0
+    for index, video in enumerate(videos or []):
+        content = await read_limited(video, min(BULK_MAX_CLIP_BYTES, BULK_MAX_BYTES - total_bytes))
+        total_bytes += len(content)
+        clips.append((video.filename or f"clip-{index}", content))
+    if archive is not None:
+        data = await read_limited(archive, BULK_MAX_BYTES - total_bytes)
+        try:
+            clips.extend(await asyncio.to_thread(read_archive, data, BULK_MAX_CLIPS,
+                                                 BULK_MAX_CLIP_BYTES, BULK_MAX_BYTES - total_bytes))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive: {e}")
+    if not clips:
+        raise HTTPException(status_code=400, detail="No clips uploaded")
+    if len(clips) > BULK_MAX_CLIPS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_CLIPS} clips per request")
+
+    vsr = await acquire_model(model)
+    # the lease is returned once the response is over, also when the client goes away
+    return StreamingResponse(stream_bulk_results(vsr, clips), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(registry.release, vsr))
+
+
+async def read_limited(upload: UploadFile, max_bytes: int) -> bytes:
+    """Read an upload into memory, answering 413 if it is larger than `max_bytes`."""
+    content = await upload.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {BULK_MAX_CLIP_BYTES // 1024 // 1024} MB "
+                                                    f"per clip and {BULK_MAX_BYTES // 1024 // 1024} MB in total")
+    return content
+
+
+def stream_event(event: str, **fields) -> str:
+    return json.dumps({"event": event, **fields}) + "\n"
+
+
+async def stream_transcription(vsr: LoadedModel, content: bytes, digest: str, cache_key: str, cached: Optional[dict],
+                               landmarks=None):
+    """Yield NDJSON events for one clip: partial hypotheses, the raw transcript, then the correction."""
+    if cached and "corrected_text" in cached:
+        log(f"⚡ Result cache hit for {digest[:12]}")
+        yield stream_event("raw", raw_output=cached["raw_output"])
+        yield stream_event("corrected", corrected_text=cached["corrected_text"], list_of_changes=cached["list_of_changes"])
+        return
+
+    try:
+        if cached:
+            raw_output = cached["raw_output"]
+        else:
+            partials = asyncio.Queue()
+            task = asyncio.create_task(run_vsr(vsr, content, digest, on_partial=partials.put_nowait, landmarks=landmarks))
+            getter = None
+            try:
+                while not task.done():
+                    getter = asyncio.ensure_future(partials.get())
+                    done, _ = await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+                    if getter in done:
+                        yield stream_event("partial", text=getter.result())
+                raw_output = task.result()
+            finally:
+                # also reached when the client disconnects mid-stream
+                if getter:
+                    getter.cancel()
+                task.cancel()
+        log(f"Raw VSR Output: {raw_output}")
+        yield stream_event("raw", raw_output=raw_output)
+
+        correction_data = await correct_output_async(raw_output)
+        await cache_result(cache_key, raw_output, correction_data)
+        yield stream_event("corrected", corrected_text=correction_data["corrected_text"],
+                           list_of_changes=correction_data["list_of_changes"])
+
+    except QueueFullError:
+        yield stream_event("error", detail="Server busy, try again shortly")
+    except DeadlineExceededError as e:
+        yield stream_event("error", detail=str(e))
+    except Exception as e:
+        log(f"❌ Critical Processing error: {str(e)}")
+        yield stream_event("error", detail=str(e))
+
+
+@app.post("/process-video/stream")
+async def process_video_stream(video: UploadFile = File(...), landmarks: Optional[UploadFile] = File(None),
+                               model: Optional[str] = None):
+    """Process a video file and stream the transcript as newline-delimited JSON events.
+
+    Emits `partial` events with the best hypothesis while the beam search runs, a
+    `raw` event as soon as the VSR transcript is ready and a `corrected` event once
+    the LLM correction arrives. Failures after the stream started are reported as
+    an `error` event.
+    """
+    vsr = await acquire_model(model)
+    try:
+        # reject before the 200 status line goes out
+        if vsr.scheduler.in_flight >= vsr.scheduler.max_queue_size:
+            raise HTTPException(status_code=429, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+        content, landmarks, digest = await read_upload(vsr, video, landmarks)
+        cache_key = ResultCache.make_key(digest, vsr.pipeline.fingerprint)
+        cached = await result_cache.get(cache_key) if result_cache else None
+    except BaseException:
+        await registry.release(vsr)
+        raise
+    return StreamingResponse(
+        stream_transcription(vsr, content, digest, cache_key, cached, landmarks),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(registry.release, vsr),
+    )
+
+
+async def send_live_partials(websocket: WebSocket, vsr: LoadedModel, session):
+    """Periodically send a CTC transcript of the latest frames of the mouth ROI cropped so far."""
+    last_patches, last_text = 0, ""
+    while True:
+        await asyncio.sleep(LIVE_PARTIAL_INTERVAL)
+        if session.num_patches == last_patches:
+            continue
+        if vsr.scheduler.queue_depth:
+            # clips are waiting for the model thread, partials give way to them
+            continue
+        last_patches = session.num_patches
+        roi = session.snapshot(LIVE_PARTIAL_MAX_FRAMES)
+        try:
+            text = await vsr.scheduler.run_model(vsr.pipeline.infer_partial, roi)
+        except Exception as e:
+            log(f"⚠️ Live partial transcript failed: {str(e)}")
+            continue
+        if text and text != last_text:
+            last_text = text
+            await websocket.send_text(stream_event("partial", text=text))
+
+
+async def run_live_utterance(websocket: WebSocket, vsr: LoadedModel) -> bool:
+    """Receive the frames of one utterance and send its transcript. Returns False once the client is done."""
+    loop = asyncio.get_running_loop()
+    session = vsr.pipeline.live_session()
+    crop_task = loop.run_in_executor(live_executor, traced, session.run)
+    # the result is dropped when the utterance is abandoned, so retrieve any error up front
+    crop_task.add_done_callback(lambda f: f.cancelled() or f.exception())
+    partial_task = asyncio.create_task(send_live_partials(websocket, vsr, session))
+    num_frames = 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                if crop_task.done():
+                    # the session thread stopped early, report why instead of waiting for its queue to fill
+                    crop_task.result()
+                try:
+                    session.push(message["bytes"])
+                except queue.Full:
+                    await websocket.send_text(stream_event("error", detail="Frames arrive faster than they can be processed"))
+                    return False
+                num_frames += 1
+            elif message.get("text") == "end":
+                break
+        session.close()
+        if num_frames == 0:
+            return True
+        try:
+            roi = await crop_task
+        except AssertionError as e:
+            # e.g. no face in any frame, the next utterance may do better
+            await websocket.send_text(stream_event("error", detail=str(e)))
+            return True
+        partial_task.cancel()
+        raw_output = await vsr.scheduler.submit(vsr.pipeline.load_roi, roi)
+        log(f"Raw VSR Output (live, {num_frames} frames, {session.num_dropped} undecodable): {raw_output}")
+        await websocket.send_text(stream_event("raw", raw_output=raw_output))
+        correction_data = await correct_output_async(raw_output)
+        await websocket.send_text(stream_event("corrected", corrected_text=correction_data["corrected_text"],
+                                               list_of_changes=correction_data["list_of_changes"]))
+        return True
     finally:
-        # Clean up temporary file
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
+        partial_task.cancel()
+        # unblock the session thread if the utterance was abandoned
+        session.close()
+
+
+@app.websocket("/ws/live")
+async def live_recognition(websocket: WebSocket, model: Optional[str] = None):
+    """Recognize speech from a live stream of frames.
+
+    The client sends every frame, at the configured input frame rate, as a binary
+    message holding an encoded image (JPEG or PNG) and the text message `end` when
+    an utterance is over. Landmark detection and mouth cropping run while frames
+    arrive; the server answers with `partial` events during the utterance and
+    `raw` / `corrected` events after it, as in /process-video/stream. The
+    connection stays open for further utterances. `?model=<name>` picks another
+    model than the default.
+    """
+    global live_sessions
+    trace_id_var.set(new_trace_id(websocket.headers.get("x-request-id")))
+    await websocket.accept()
+    if live_sessions >= MAX_LIVE_SESSIONS:
+        await websocket.send_text(stream_event("error", detail="Server busy, try again shortly"))
+        await websocket.close(code=1013)
+        return
+    # taken before waiting for the model, so sessions connecting while it loads cannot exceed the
+    # limit (and the live threads, one per session)
+    live_sessions += 1
+    try:
+        vsr = await acquire_model(model)
+    except HTTPException as e:
+        live_sessions -= 1
+        await websocket.send_text(stream_event("error", detail=e.detail))
+        await websocket.close(code=1008 if e.status_code == 404 else 1011)
+        return
+    except BaseException:
+        # e.g. cancelled while the model loads
+        live_sessions -= 1
+        raise
+
+    try:
+        while await run_live_utterance(websocket, vsr):
+            pass
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except (QueueFullError, DeadlineExceededError) as e:
+        await websocket.send_text(stream_event("error", detail=str(e) or "Server busy, try again shortly"))
+        await websocket.close(code=1013)
+    except Exception as e:
+        log(f"❌ Live session error: {str(e)}")
+        await websocket.send_text(stream_event("error", detail=str(e)))
+        await websocket.close(code=1011)
+    finally:
+        live_sessions -= 1
+        await registry.release(vsr)
+
+
+async def warmup_model(vsr: LoadedModel):
+    """Run synthetic clips through the pipeline, then mark the model ready."""
+    global model_ready
+    print(f"Warming up VSR model with clips of {WARMUP_LENGTHS} frames...", flush=True)
+    start_time = time.time()
+    try:
+        await vsr.scheduler.warmup(WARMUP_LENGTHS)
+        print(f"✅ VSR model warmed up in {time.time() - start_time:.2f} seconds", flush=True)
+    except Exception as e:
+        # the model itself loaded, so serve anyway; the first requests are just slower
+        print(f"⚠️ VSR model warmup failed after {time.time() - start_time:.2f} seconds: {str(e)}", flush=True)
+    model_ready = True
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the default model is loaded and warmed up, 503 until then."""
+    loaded = default_model_loaded()
+    if not (loaded and model_ready):
+        return JSONResponse(status_code=503, content={"ready": False, "model_loaded": loaded})
+    return {"ready": True, "model_loaded": True}
+
+
+@app.get("/models")
+async def list_models():
+    """Models that can be picked with ?model=<name>, and the ones currently in memory."""
+    if registry is None:
+        raise HTTPException(status_code=503, detail="VSR model not loaded")
+    return {"default": DEFAULT_MODEL, **registry.stats()}
+
+
+def default_model_loaded() -> bool:
+    return bool(registry and DEFAULT_MODEL in registry.models)
+
+
+def resident_schedulers() -> List[BatchScheduler]:
+    return [vsr.scheduler for vsr in registry.models.values()] if registry else []
+
+
+# Pipeline stage timings are collected per clip (or per batch) on the worker threads
+timing.add_observer(observe_trace)
+
+
+def cache_stat(stats_name: str):
+    # read a hit/miss count out of each cache's stats() at scrape time
+    def read():
+        values = {("correction",): correction_cache.stats()[stats_name]}
+        if result_cache:
+            stats = result_cache.stats()
+            values[("result",)] = stats[stats_name]
+            if result_cache.store_intermediates:
+                values[("intermediates",)] = stats[f"intermediate_{stats_name}"]
+        return values
+    return read
+
+
+REGISTRY.register(Gauge("vsr_queue_depth", "Preprocessed clips waiting for the model.",
+                        function=lambda: {(): sum(scheduler.queue_depth for scheduler in resident_schedulers())}))
+REGISTRY.register(Gauge("vsr_in_flight", "Requests admitted and not yet answered.",
+                        function=lambda: {(): sum(scheduler.in_flight for scheduler in resident_schedulers())}))
+REGISTRY.register(Gauge("vsr_live_sessions", "Open live recognition sessions.",
+                        function=lambda: {(): live_sessions}))
+REGISTRY.register(Gauge("vsr_ready", "1 once the model is loaded and warmed up.",
+                        function=lambda: {(): int(default_model_loaded() and model_ready)}))
+REGISTRY.register(Gauge("vsr_model_bytes", "Memory used by the weights of the models in memory.",
+                        function=lambda: {(): registry.total_bytes if registry else 0}))
+REGISTRY.register(Gauge("vsr_models_loaded", "Models currently in memory.",
+                        function=lambda: {(): len(registry.models) if registry else 0}))
+REGISTRY.register(Gauge("vsr_cache_bytes", "Memory used by the result cache.",
+                        function=lambda: {(): result_cache.total_bytes if result_cache else 0}))
+REGISTRY.register(Counter("vsr_cache_hits", "Cache lookups answered from the cache.", ["cache"],
+                          function=cache_stat("hits")))
+REGISTRY.register(Counter("vsr_cache_misses", "Cache lookups that had to compute the result.", ["cache"],
+                          function=cache_stat("misses")))
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints are disabled unless ADMIN_TOKEN is set, and then require it in X-Admin-Token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+class ProfilerConfig(BaseModel):
+    sample_rate: Optional[float] = None
+    max_mb: Optional[float] = None
+
+
+def profiler_state() -> dict:
+    return {
+        "sample_rate": profiler.sample_rate,
+        "trace_dir": profiler.trace_dir,
+        "max_mb": profiler.max_bytes / 1024 / 1024,
+        "traces": [{"name": os.path.basename(path), "bytes": size} for path, size in profiler.traces()],
+    }
+
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+async def get_profiler():
+    """Current profiler settings and the stored traces."""
+    return await asyncio.to_thread(profiler_state)
+
+
+@app.post("/admin/profiler", dependencies=[Depends(require_admin)])
+async def configure_profiler(config: ProfilerConfig):
+    """Change the fraction of model calls that are profiled (0 turns profiling off) or the trace size cap."""
+    max_bytes = int(config.max_mb * 1024 * 1024) if config.max_mb is not None else None
+    profiler.configure(sample_rate=config.sample_rate, max_bytes=max_bytes)
+    log(f"Profiler sample rate set to {profiler.sample_rate}")
+    return await asyncio.to_thread(profiler_state)
+
+
+@app.get("/admin/profiler/traces/{name}", dependencies=[Depends(require_admin)])
+async def download_trace(name: str):
+    """Download a stored Chrome trace."""
+    # only serve files that are listed in the trace directory
+    paths = {os.path.basename(path): path for path, _ in await asyncio.to_thread(profiler.traces)}
+    if name not in paths:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return FileResponse(paths[name], media_type="application/json", filename=name)
+
+
+@app.post("/admin/models/{name}/reload", status_code=202, dependencies=[Depends(require_admin)])
+async def reload_model(name: str):
+    """Reload a model from its config, e.g. after its checkpoint was replaced, without dropping requests.
+
+    Returns right away; the model keeps serving from the current weights until
+    the new ones are loaded and warmed up, and `/models` lists it under
+    `reloading` until then.
+    """
+    if registry is None:
+        raise HTTPException(status_code=503, detail="VSR model not loaded")
+    try:
+        # the preprocessing threads are warm and busy serving, only warm the new model
+        registry.reload(name, lambda vsr: vsr.scheduler.warmup(WARMUP_LENGTHS, preprocess=False))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model {name}, see /models")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    log(f"Reloading VSR model {name}")
+    return {"model": name, "status": "reloading"}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics in the text exposition format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/health")
@@ -224,8 +977,16 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "model_loaded": vsr_model is not None,
-        "device": str(vsr_model.model.device) if vsr_model else "N/A"
+        "model_loaded": default_model_loaded(),
+        "ready": model_ready,
+        "device": str(registry.models[DEFAULT_MODEL].pipeline.model.device) if default_model_loaded() else "N/A",
+        "models": list(registry.models) if registry else [],
+        "queue_depth": sum(scheduler.queue_depth for scheduler in resident_schedulers()),
+        "in_flight": sum(scheduler.in_flight for scheduler in resident_schedulers()),
+        "max_queue_size": MAX_QUEUE_SIZE,
+        "live_sessions": live_sessions,
+        "cache": result_cache.stats() if result_cache else None,
+        "correction_cache": correction_cache.stats(),
     }
 
 
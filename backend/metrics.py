@@ -0,0 +1,180 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# seconds, from a single frame up to a long clip
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value not in (float("inf"), float("-inf")) else ("+Inf" if value > 0 else "-Inf")
+
+
+class Metric:
+    """Base class of a metric family in the Prometheus text exposition format."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def label_key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @property
+    def family_name(self) -> str:
+        """Name of the metric family in the HELP and TYPE lines."""
+        return self.name
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.family_name} {self.documentation}", f"# TYPE {self.family_name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A monotonically increasing count, either incremented here or read from `function` at scrape time."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.function = function
+
+    @property
+    def family_name(self) -> str:
+        # the family is named like its samples, as prometheus_client does
+        return f"{self.name}_total"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [(self.family_name, dict(zip(self.labelnames, key)), value) for key, value in values.items()]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, either set explicitly or read from `function` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: count per bucket (plus +Inf), sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            counts, total = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative))
+                samples.append((f"{self.name}_sum", labels, total[0]))
+                samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "vsr_stage_seconds", "Time spent in each pipeline stage per clip (per batch for model stages).", ["stage"]))
+BEAM_STEP_SECONDS = REGISTRY.register(Histogram(
+    "vsr_beam_step_seconds", "Duration of a single beam search step.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)))
+CLIP_FRAMES = REGISTRY.register(Histogram(
+    "vsr_clip_frames", "Number of video frames per clip.", buckets=(25, 50, 75, 100, 150, 200, 300, 500, 1000)))
+CLIP_SECONDS = REGISTRY.register(Histogram(
+    "vsr_clip_duration_seconds", "Duration of the uploaded clips.", buckets=(1, 2, 3, 5, 8, 13, 20, 30, 60)))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "vsr_batch_size", "Number of clips per model batch.", buckets=(1, 2, 4, 8, 16, 32)))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "vsr_queue_wait_seconds", "Time a preprocessed clip waits before its batch starts."))
+REQUESTS = REGISTRY.register(Counter(
+    "vsr_requests", "HTTP requests by endpoint and status code.", ["endpoint", "status"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "vsr_request_seconds", "End-to-end HTTP request latency by endpoint.", ["endpoint"]))
+
+
+def observe_trace(trace):
+    """Feed the stage timings and measurements of a finished pipeline trace into the metrics."""
+    for name, seconds in trace.stages.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+    for seconds in trace.values.get("beam_step", ()):
+        BEAM_STEP_SECONDS.observe(seconds)
+    for frames in trace.values.get("frames", ()):
+        CLIP_FRAMES.observe(frames)
+    for seconds in trace.values.get("clip_seconds", ()):
+        CLIP_SECONDS.observe(seconds)
@@ -0,0 +1,242 @@
+import asyncio
+import gc
+import os
+import time
+from collections import OrderedDict
+from configparser import ConfigParser
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import torch
+
+
+def tensor_sizes(module) -> Dict[int, int]:
+    """Bytes of every weight and buffer of `module`, keyed by data pointer so shared tensors count once."""
+    sizes = {}
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        sizes[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sizes
+
+
+def estimate_bytes(config_filename: str) -> int:
+    """Rough size of a pipeline before loading it: its checkpoint files."""
+    config = ConfigParser()
+    config.read(config_filename)
+    total = 0
+    for option in ("model_path", "rnnlm"):
+        path = config.get("model", option, fallback=None)
+        if path and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+class LoadedModel:
+    """A resident pipeline and the scheduler batching its requests."""
+
+    def __init__(self, name: str, pipeline, scheduler):
+        self.name = name
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        # requests currently using the model; it is only unloaded once this drops to 0
+        self.leases = 0
+        self.loaded_at = time.time()
+        self.tensors = tensor_sizes(pipeline)
+        # set once the model was replaced and its last lease returned
+        self.drained = asyncio.Event()
+
+    @property
+    def bytes(self) -> int:
+        return sum(self.tensors.values())
+
+
+class ModelRegistry:
+    """Pipelines loaded on demand by config name and kept under a memory budget.
+
+    Every `.ini` file in `config_dir` is a model, named after the file. A model
+    is loaded with `load(config_filename)` (in a thread) the first time it is
+    leased, gets its own scheduler from `make_scheduler(pipeline)` and stays
+    resident until the weights of all resident models exceed `max_bytes` (0 for
+    no limit). The least recently used models that nobody holds a lease on are
+    then unloaded; `pinned` models never are. Weights shared between pipelines,
+    such as a language model, are counted once.
+    """
+
+    def __init__(self, config_dir: str, load: Callable[[str], Any], make_scheduler: Callable[[Any], Any],
+                 max_bytes: int = 0, pinned: Optional[List[str]] = None):
+        self.config_dir = Path(config_dir)
+        self.load = load
+        self.make_scheduler = make_scheduler
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned or [])
+        # least recently used first
+        self.models: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self.loading: Dict[str, asyncio.Future] = {}
+        self.reloading: Dict[str, asyncio.Task] = {}
+        # models replaced by a reload that still serve their last requests
+        self.draining: List[LoadedModel] = []
+
+    def available(self) -> List[str]:
+        return sorted(path.stem for path in self.config_dir.glob("*.ini"))
+
+    def config_filename(self, name: str) -> str:
+        if name not in self.available():
+            raise KeyError(name)
+        return str(self.config_dir / f"{name}.ini")
+
+    @property
+    def total_bytes(self) -> int:
+        sizes = {}
+        for model in list(self.models.values()) + self.draining:
+            sizes.update(model.tensors)
+        return sum(sizes.values())
+
+    async def add(self, name: str, pipeline) -> LoadedModel:
+        """Make an already loaded pipeline resident under `name`."""
+        scheduler = self.make_scheduler(pipeline)
+        await scheduler.start()
+        model = self.models[name] = LoadedModel(name, pipeline, scheduler)
+        return model
+
+    async def acquire(self, name: str) -> LoadedModel:
+        """Lease model `name`, loading it first if needed. Raises KeyError for an unknown name."""
+        self.config_filename(name)
+        model = self.models.get(name)
+        while model is None:
+            task = self.loading.get(name)
+            if task is None:
+                # concurrent requests for the same model share one load
+                task = self.loading[name] = asyncio.ensure_future(self._load(name))
+                task.add_done_callback(lambda _: self.loading.pop(name, None))
+            await asyncio.shield(task)
+            # unloaded again before this request got to it if memory is that tight
+            model = self.models.get(name)
+        model.leases += 1
+        self.models.move_to_end(name)
+        await self.evict()
+        return model
+
+    async def release(self, model: LoadedModel):
+        model.leases -= 1
+        if model.leases == 0 and self.models.get(model.name) is not model:
+            model.drained.set()
+        await self.evict()
+
+    def reload(self, name: str, warmup: Callable[[LoadedModel], Awaitable[Any]]) -> asyncio.Task:
+        """Replace model `name` with a fresh load of its config without interrupting requests.
+
+        The new pipeline is loaded and warmed up with `warmup(model)` next to the
+        old one, then takes over all new requests at once. The old one finishes
+        the requests already holding a lease on it and is unloaded after the
+        last of them, and counts against the memory budget until then. If loading
+        or warming up fails the old one keeps serving.
+        Raises KeyError for an unknown name and RuntimeError if a reload of the
+        model is already running.
+        """
+        self.config_filename(name)
+        if name in self.reloading:
+            raise RuntimeError(f"{name} is already being reloaded")
+        task = self.reloading[name] = asyncio.create_task(self._reload(name, warmup))
+        task.add_done_callback(lambda _: self.reloading.pop(name, None))
+        return task
+
+    async def stop(self):
+        for task in list(self.reloading.values()):
+            task.cancel()
+        for model in self.models.values():
+            await model.scheduler.stop()
+        self.models.clear()
+
+    async def _load(self, name: str) -> LoadedModel:
+        config_filename = self.config_filename(name)
+        # make room up front, so loading does not push memory far beyond the budget
+        await self.evict(await asyncio.to_thread(estimate_bytes, config_filename))
+        print(f"Loading VSR model {name}...", flush=True)
+        start_time = time.time()
+        pipeline = await asyncio.to_thread(self.load, config_filename)
+        model = await self.add(name, pipeline)
+        print(f"✅ VSR model {name} loaded in {time.time() - start_time:.2f} seconds "
+              f"({model.bytes / 1024 / 1024:.0f} MB)", flush=True)
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            print(f"⚠️ Models in memory use {self.total_bytes / 1024 / 1024:.0f} MB, over the "
+                  f"{self.max_bytes / 1024 / 1024:.0f} MB budget, until requests on the others finish", flush=True)
+        return model
+
+    async def _reload(self, name: str, warmup: Callable[[LoadedModel], Awaitable[Any]]):
+        print(f"Reloading VSR model {name}...", flush=True)
+        start_time = time.time()
+        try:
+            config_filename = self.config_filename(name)
+            # the new copy is loaded next to the current one, make room for it as _load does
+            await self.evict(await asyncio.to_thread(estimate_bytes, config_filename))
+            pipeline = await asyncio.to_thread(self.load, config_filename)
+            scheduler = self.make_scheduler(pipeline)
+            await scheduler.start()
+            model = LoadedModel(name, pipeline, scheduler)
+        except Exception as e:
+            print(f"❌ Failed to reload VSR model {name}, keeping the current one: {e}", flush=True)
+            return
+        try:
+            await warmup(model)
+        except Exception as e:
+            await scheduler.stop()
+            print(f"❌ Warmup of the reloaded VSR model {name} failed, keeping the current one: {e}", flush=True)
+            return
+
+        # from here on new requests lease the new model
+        old = self.models.get(name)
+        self.models[name] = model
+        self.models.move_to_end(name)
+        print(f"✅ VSR model {name} reloaded in {time.time() - start_time:.2f} seconds", flush=True)
+        if old is None:
+            return
+        # its weights stay in memory, and in the budget, until it is unloaded
+        self.draining.append(old)
+        await self.evict()
+        try:
+            if old.leases:
+                print(f"Draining {old.leases} requests on the previous {name} model...", flush=True)
+                await old.drained.wait()
+            await old.scheduler.stop()
+        finally:
+            self.draining.remove(old)
+        del old
+        self.free()
+        print(f"Unloaded the previous {name} model", flush=True)
+        await self.evict()
+
+    async def evict(self, reserve: int = 0):
+        """Unload idle models, least recently used first, until `reserve` more bytes fit in the budget."""
+        if not self.max_bytes:
+            return
+        for name, model in list(self.models.items()):
+            if self.total_bytes + reserve <= self.max_bytes:
+                break
+            # skip models in use, being reloaded, or that a concurrent eviction already took
+            if model.leases or name in self.pinned or name in self.reloading or self.models.get(name) is not model:
+                continue
+            await self.unload(name)
+
+    async def unload(self, name: str):
+        model = self.models.pop(name)
+        await model.scheduler.stop()
+        print(f"Unloaded VSR model {name}", flush=True)
+        del model
+        self.free()
+
+    @staticmethod
+    def free():
+        # return the memory of unloaded pipelines right away
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "available": self.available(),
+            "resident": {name: {"bytes": model.bytes, "leases": model.leases, "loaded_at": model.loaded_at}
+                         for name, model in self.models.items()},
+            "reloading": sorted(self.reloading),
+            "draining": [model.name for model in self.draining],
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
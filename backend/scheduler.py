@@ -0,0 +1,252 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.metrics import BATCH_SIZE, QUEUE_WAIT_SECONDS
+from backend.tracing import add_timings
+from pipelines.timing import current_stages, trace
+
+
+class QueueFullError(Exception):
+    """Raised when a request is rejected because the admission queue is full."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request could not be served before its deadline."""
+
+
+def run_traced(fn: Callable, *args) -> Tuple[Any, Dict[str, float]]:
+    # time the pipeline stages run by `fn` on this worker thread
+    with trace() as timings:
+        result = fn(*args)
+    return result, dict(timings.stages)
+
+
+def traced(fn: Callable, *args) -> Any:
+    return run_traced(fn, *args)[0]
+
+
+class BatchScheduler:
+    """Collect concurrently arriving clips and run them through the model in one batch.
+
+    Every request is admitted into a bounded queue, preprocessed (decode, detection,
+    cropping) on a pool of `num_workers` threads and then handed to the batching
+    loop. The loop waits at most `max_wait_ms` after the first clip of a batch for
+    more clips to arrive, runs a single padded encoder pass plus beam search over up
+    to `max_batch_size` clips on a dedicated model thread, and resolves each
+    request's future as soon as its own beam search is done, without waiting for
+    the rest of the batch. Nothing blocking runs on the event loop.
+
+    Schedulers of different models can share one `preprocess_executor`, which
+    they then leave running when stopped.
+    """
+
+    def __init__(self, pipeline, max_batch_size: int = 8, max_wait_ms: float = 20.0,
+                 num_workers: int = 2, max_queue_size: int = 32, timeout: float = 30.0,
+                 preprocess_executor: Optional[ThreadPoolExecutor] = None):
+        self.pipeline = pipeline
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.num_workers = max(1, num_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.timeout = timeout
+        # requests admitted and not yet answered (preprocessing, queued or decoding)
+        self.in_flight = 0
+        self.queue: Optional[asyncio.Queue] = None
+        # signalled whenever a request leaves, for callers waiting to be admitted
+        self.admission: Optional[asyncio.Condition] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.preprocess_executor = preprocess_executor
+        self.owns_preprocess_executor = preprocess_executor is None
+        # the beam search keeps per-utterance scorer state, so model calls are serialized
+        self.model_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of preprocessed clips waiting for the model."""
+        return self.queue.qsize() if self.queue else 0
+
+    async def start(self):
+        """Start the worker pools and the batching loop on the running event loop."""
+        self.queue = asyncio.Queue()
+        self.admission = asyncio.Condition()
+        if self.owns_preprocess_executor:
+            self.preprocess_executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="vsr-preprocess")
+        self.model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vsr-model")
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop, fail any requests still waiting and release the pools."""
+        if self.worker:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        while self.queue and not self.queue.empty():
+            _, future, _, _, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Scheduler stopped"))
+        executors = [self.model_executor]
+        if self.owns_preprocess_executor:
+            executors.append(self.preprocess_executor)
+        for executor in executors:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, preprocess: Callable, *args, timeout: Optional[float] = None,
+                     on_partial: Optional[Callable[[str], Any]] = None, block: bool = False) -> str:
+        """Preprocess a clip with `preprocess(*args)`, queue it and wait for its transcript.
+
+        If `on_partial` is given it is called on the event loop with the best
+        partial transcript whenever it changes during beam search. The time the
+        clip spends in each stage, including the whole model batch it was part
+        of, is added to the current request's timing breakdown.
+
+        Raises QueueFullError when `max_queue_size` requests are already in flight,
+        unless `block` is set, in which case it waits for a free slot first. Raises
+        DeadlineExceededError when no transcript is ready within `timeout` seconds
+        of being admitted. A request whose preprocessing is still running when it
+        gives up counts as in flight until the preprocessing thread is done.
+        """
+        if self.in_flight >= self.max_queue_size:
+            if not block:
+                raise QueueFullError(f"{self.in_flight} requests already in flight")
+            async with self.admission:
+                await self.admission.wait_for(lambda: self.in_flight < self.max_queue_size)
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = loop.time() + timeout
+        self.in_flight += 1
+        preprocessing = None
+        try:
+            # run in a copy of the request's context so its trace ID reaches the worker thread
+            context = contextvars.copy_context()
+            preprocessing = loop.run_in_executor(self.preprocess_executor, context.run, run_traced, preprocess, *args)
+            # shielded, so the future stays pending for as long as the thread actually runs
+            data, stages = await asyncio.wait_for(asyncio.shield(preprocessing), timeout)
+            add_timings(stages)
+            future = loop.create_future()
+            callback = None
+            if on_partial is not None:
+                # beam search runs on the model thread, hand the partials back to the loop
+                def forward_partial(text):
+                    if not future.done():
+                        loop.call_soon_threadsafe(on_partial, text)
+                callback = forward_partial
+            await self.queue.put((data, future, deadline, callback, loop.time()))
+            result, stages = await asyncio.wait_for(future, max(0.0, deadline - loop.time()))
+            add_timings(stages)
+            return result
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError(f"No result within {timeout:.1f} seconds")
+        finally:
+            if preprocessing is not None and not preprocessing.done():
+                # a thread cannot be stopped, so after a timeout or cancellation the request
+                # keeps its slot until preprocessing is over and in-flight work stays bounded
+                preprocessing.add_done_callback(lambda f: loop.create_task(self._release(f)))
+            else:
+                await self._release()
+
+    async def _release(self, preprocessing: Optional[asyncio.Future] = None):
+        if preprocessing is not None and not preprocessing.cancelled():
+            # nobody awaits an abandoned preprocessing result, retrieve its error
+            preprocessing.exception()
+        self.in_flight -= 1
+        async with self.admission:
+            self.admission.notify()
+
+    async def warmup(self, lengths: List[int], preprocess: bool = True):
+        """Warm the preprocessing threads and the model before serving requests.
+
+        Every preprocessing thread builds and runs its own landmarks detector, then
+        the model thread decodes synthetic clips of the given lengths (in frames).
+        Set `preprocess` to False to only warm the model, e.g. while the threads
+        are busy serving another model.
+        """
+        loop = asyncio.get_running_loop()
+        # the barrier keeps each warmup call on its own thread until all threads have one
+        barrier = threading.Barrier(self.num_workers, timeout=60)
+
+        def warm_worker():
+            barrier.wait()
+            self.pipeline.warmup_preprocess()
+
+        if preprocess:
+            await asyncio.gather(*[loop.run_in_executor(self.preprocess_executor, warm_worker)
+                                   for _ in range(self.num_workers)])
+        if lengths:
+            # not traced, so synthetic clips stay out of the stage metrics
+            await loop.run_in_executor(self.model_executor, self.pipeline.warmup_model, lengths)
+
+    async def run_model(self, fn: Callable, *args) -> Any:
+        """Run `fn(*args)` on the model thread, between batches."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.model_executor, traced, fn, *args)
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future, Optional[Callable], float]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        batch_deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            wait = batch_deadline - loop.time()
+            if wait <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), wait))
+            except asyncio.TimeoutError:
+                break
+        # requests that timed out or whose client went away do not need to be decoded
+        now = loop.time()
+        batch = [(data, future, callback, now - queued_at)
+                 for data, future, deadline, callback, queued_at in batch if not future.done() and deadline > now]
+        for *_, queue_wait in batch:
+            QUEUE_WAIT_SECONDS.observe(queue_wait)
+        return batch
+
+    async def _infer(self, batch: List[Tuple[Any, asyncio.Future, Optional[Callable], float]]):
+        """Run clips through the model, resolving each clip's future as soon as its own decode is done."""
+        loop = asyncio.get_running_loop()
+        BATCH_SIZE.observe(len(batch))
+
+        def resolve(future, queue_wait, result, stages):
+            if not future.done():
+                future.set_result((result, {"queue": queue_wait, **stages}))
+
+        def on_result(index, result):
+            # on the model thread: the clip waited for the shared encode and the decodes before its own
+            _, future, _, queue_wait = batch[index]
+            loop.call_soon_threadsafe(resolve, future, queue_wait, result, current_stages())
+
+        inputs = [data for data, _, _, _ in batch]
+        callbacks = [callback for _, _, callback, _ in batch]
+        await loop.run_in_executor(self.model_executor, traced, self.pipeline.infer_batch, inputs, callbacks, on_result)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            try:
+                await self._infer(batch)
+            except Exception as e:
+                # clips decoded before the failure already have their transcript
+                pending = [item for item in batch if not item[1].done()]
+                if len(batch) > 1 and pending:
+                    # one bad clip should not fail the whole batch, retry the rest individually
+                    print(f"⚠️ Batched inference failed ({e}), retrying {len(pending)} clips one by one", flush=True)
+                    for item in pending:
+                        try:
+                            await self._infer([item])
+                        except Exception as clip_error:
+                            if not item[1].done():
+                                item[1].set_exception(clip_error)
+                else:
+                    for _, future, _, _ in pending:
+                        future.set_exception(e)
@@ -0,0 +1,133 @@
+"""Serve the backend from several worker processes that share one copy of the model.
+
+The parent process loads the model once, then forks the workers. Forked
+workers share the parent's memory pages until a page is written, and the
+weights are never written at inference time, so N workers cost roughly one
+model's worth of RAM instead of N. Every worker runs its own event loop,
+scheduler and detectors on the shared listening socket.
+
+    python backend/serve.py --workers 4 --port 8000
+
+Fork and CUDA do not mix, so the model is always loaded on the CPU here;
+run `backend/main.py` to serve from a GPU.
+"""
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).resolve().parent.parent
+if str(root_dir) not in sys.path:
+    sys.path.append(str(root_dir))
+
+import cv2
+import torch
+import uvicorn
+
+from backend import main
+
+
+# a worker that dies sooner than this after being forked is restarted with a delay,
+# so a worker that cannot start does not turn into a fork loop
+MIN_WORKER_UPTIME_S = 5.0
+
+
+def freeze_model(pipeline):
+    """Make the loaded weights read-only so nothing dirties the shared pages."""
+    pipeline.requires_grad_(False)
+    pipeline.eval()
+    # objects alive now stay out of the garbage collector's generations, whose
+    # bookkeeping would otherwise write to (and copy) every page they live on
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(sock, config, threads):
+    """Body of a forked worker; never returns."""
+    status = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        torch.set_num_threads(threads)
+        # also bounds the threads cropping frames in parallel
+        cv2.setNumThreads(threads)
+        print(f"👷 Worker {os.getpid()} serving with {threads} intra-op threads", flush=True)
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException as e:
+        print(f"❌ Worker {os.getpid()} failed: {e}", flush=True)
+        status = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(status)
+
+
+def spawn(sock, config, threads):
+    pid = os.fork()
+    if pid == 0:
+        run_worker(sock, config, threads)
+    return pid
+
+
+def serve(host, port, workers, threads):
+    # a single thread while loading, so no OpenMP pool exists yet when the workers are
+    # forked; each worker sets its own thread count afterwards
+    torch.set_num_threads(1)
+    main.load_model(device=torch.device("cpu"), eager_detector=False)
+    if main.preloaded_model is None:
+        raise SystemExit(1)
+    freeze_model(main.preloaded_model)
+
+    config = uvicorn.Config(main.app, host=host, port=port, lifespan="on")
+    sock = config.bind_socket()
+
+    started = {}
+    for _ in range(workers):
+        started[spawn(sock, config, threads)] = time.monotonic()
+    print(f"✅ Serving on http://{host}:{port} with {workers} workers", flush=True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in started:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while started:
+        pid, status = os.wait()
+        forked_at = started.pop(pid, None)
+        if forked_at is None or stopping:
+            continue
+        print(f"⚠️ Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting", flush=True)
+        if time.monotonic() - forked_at < MIN_WORKER_UPTIME_S:
+            time.sleep(MIN_WORKER_UPTIME_S)
+        if not stopping:
+            started[spawn(sock, config, threads)] = time.monotonic()
+    sock.close()
+
+
+def main_cli():
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    workers = int(os.getenv("VSR_WORKERS", "2"))
+    parser = argparse.ArgumentParser(description="Serve the backend from pre-forked workers sharing the model weights.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=workers)
+    parser.add_argument("--threads-per-worker", type=int, default=int(os.getenv("VSR_THREADS_PER_WORKER", "0")),
+                        help="intra-op threads of each worker (default: CPUs / workers)")
+    args = parser.parse_args()
+    threads = args.threads_per_worker or max(1, cpus // args.workers)
+    serve(args.host, args.port, max(1, args.workers), threads)
+
+
+if __name__ == "__main__":
+    main_cli()
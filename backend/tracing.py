@@ -0,0 +1,48 @@
+import re
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from backend.metrics import STAGE_SECONDS
+
+
+# ID of the request being served, prefixed to its log lines
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+# stage name -> seconds spent on it by the request being served
+stage_timings_var: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def new_trace_id(requested: Optional[str] = None) -> str:
+    """Use the caller's X-Request-ID if it is safe to log, otherwise generate an ID."""
+    if requested and TRACE_ID_PATTERN.match(requested):
+        return requested
+    return uuid.uuid4().hex[:16]
+
+
+def log(message: str):
+    """Print a log line tagged with the current request's trace ID."""
+    print(f"[{trace_id_var.get()}] {message}", flush=True)
+
+
+def add_timings(stages: Dict[str, float]):
+    """Add stage durations (seconds) to the breakdown of the current request, if one is collected."""
+    timings = stage_timings_var.get()
+    if timings is None:
+        return
+    for name, seconds in stages.items():
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def observe_stage(name: str, seconds: float):
+    """Record a stage that runs on the event loop, in both the metrics and the request breakdown."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    add_timings({name: seconds})
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    """Format a Server-Timing header value, durations in milliseconds."""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
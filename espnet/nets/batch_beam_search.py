@@ -284,6 +284,18 @@ class BatchBeamSearch(BeamSearch):
             )
         return self.batchfy(best_hyps)
 
+    def best_running_yseq(self, running_hyps: BatchHypothesis) -> torch.Tensor:
+        """Return the token sequence of the best running hypothesis.
+
+        Args:
+            running_hyps (BatchHypothesis): The running hypotheses in beam search.
+
+        Returns:
+            torch.Tensor: Token ids of the best hypothesis, starting with <sos>.
+
+        """
+        return running_hyps.yseq[0, : running_hyps.length[0]]
+
     def post_process(
         self,
         i: int,
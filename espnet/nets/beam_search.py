@@ -3,6 +3,7 @@
 from itertools import chain
 import logging
 from typing import Any
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import NamedTuple
@@ -333,8 +334,24 @@ class BeamSearch(torch.nn.Module):
             ]
         return best_hyps
 
+    def best_running_yseq(self, running_hyps: List[Hypothesis]) -> torch.Tensor:
+        """Return the token sequence of the best running hypothesis.
+
+        Args:
+            running_hyps (List[Hypothesis]): The running hypotheses in beam search.
+
+        Returns:
+            torch.Tensor: Token ids of the best hypothesis, starting with <sos>.
+
+        """
+        return running_hyps[0].yseq
+
     def forward(
-        self, x: torch.Tensor, maxlenratio: float = 0.0, minlenratio: float = 0.0
+        self,
+        x: torch.Tensor,
+        maxlenratio: float = 0.0,
+        minlenratio: float = 0.0,
+        partial_callback: Callable[[torch.Tensor], None] = None,
     ) -> List[Hypothesis]:
         """Perform beam search.
 
@@ -346,6 +363,8 @@ class BeamSearch(torch.nn.Module):
                 If maxlenratio<0.0, its absolute value is interpreted
                 as a constant max output length.
             minlenratio (float): Input length ratio to obtain min output length.
+            partial_callback (Callable): Called after every step with the token
+                ids of the current best running hypothesis.
 
         Returns:
             list[Hypothesis]: N-best decoding results
@@ -371,6 +390,8 @@ class BeamSearch(torch.nn.Module):
             best = self.search(running_hyps, x)
             # post process of one iteration
             running_hyps = self.post_process(i, maxlen, maxlenratio, best, ended_hyps)
+            if partial_callback is not None and len(running_hyps) > 0:
+                partial_callback(self.best_running_yseq(running_hyps))
             # end detection
             if maxlenratio == 0.0 and end_detect([h.asdict() for h in ended_hyps], i):
                 logging.info(f"end detected at {i}")
@@ -391,7 +412,9 @@ class BeamSearch(torch.nn.Module):
             return (
                 []
                 if minlenratio < 0.1
-                else self.forward(x, maxlenratio, max(0.0, minlenratio - 0.1))
+                else self.forward(
+                    x, maxlenratio, max(0.0, minlenratio - 0.1), partial_callback
+                )
             )
 
         # report the best result
@@ -17,6 +17,7 @@ from espnet.nets.e2e_asr_common import ErrorCalculator
 from espnet.nets.pytorch_backend.ctc import CTC
 from espnet.nets.pytorch_backend.nets_utils import get_subsample
 from espnet.nets.pytorch_backend.nets_utils import make_non_pad_mask
+from espnet.nets.pytorch_backend.nets_utils import pad_list
 from espnet.nets.pytorch_backend.nets_utils import th_accuracy
 from espnet.nets.pytorch_backend.transformer.add_sos_eos import add_sos_eos
 from espnet.nets.pytorch_backend.transformer.attention import (
@@ -318,3 +319,18 @@ class E2E(torch.nn.Module):
         else:
             enc_output, _ = self.encoder(x, None)
             return enc_output.squeeze(0)
+
+    def encode_batch(self, xs):
+        """Encode a batch of variable-length visual features in one pass.
+
+        :param list xs: list of source visual features, each (C, T_i, H, W)
+        :return: list of encoder outputs, each (T_i, D)
+        :rtype: List[torch.Tensor]
+        """
+        self.eval()
+        lengths = [x.size(1) for x in xs]
+        # pad along time: (T_i, C, H, W) -> (B, Tmax, C, H, W) -> (B, C, Tmax, H, W)
+        xs_pad = pad_list([x.transpose(0, 1) for x in xs], 0.0).transpose(1, 2)
+        masks = make_non_pad_mask(lengths).to(xs_pad.device).unsqueeze(-2)
+        enc_output, _ = self.encoder(xs_pad, masks)
+        return [enc_output[i, :length] for i, length in enumerate(lengths)]
@@ -43,10 +43,11 @@ class ConvolutionModule(nn.Module):
         )
         self.activation = Swish()
 
-    def forward(self, x):
+    def forward(self, x, mask_pad=None):
         """Compute covolution module.
 
         :param torch.Tensor x: (batch, time, size)
+        :param torch.Tensor mask_pad: non-padding mask (batch, 1, time)
         :return torch.Tensor: convoluted `value` (batch, time, d_model)
         """
         # exchange the temporal dimension and the feature dimension
@@ -56,6 +57,10 @@ class ConvolutionModule(nn.Module):
         x = self.pointwise_cov1(x)  # (batch, 2*channel, dim)
         x = nn.functional.glu(x, dim=1)  # (batch, channel, dim)
 
+        # zero padded frames so they do not leak into the depthwise conv
+        if mask_pad is not None:
+            x = x.masked_fill(~mask_pad, 0.0)
+
         # 1D Depthwise Conv
         x = self.depthwise_conv(x)
         x = self.activation(self.norm(x))
@@ -125,7 +125,8 @@ class EncoderLayer(nn.Module):
             residual = x
             if self.normalize_before:
                 x = self.norm_conv(x)
-            x = residual + self.dropout(self.conv_module(x))
+            mask_pad = mask if cache is None and mask is not None else None
+            x = residual + self.dropout(self.conv_module(x, mask_pad))
             if not self.normalize_before:
                 x = self.norm_conv(x)
 
@@ -50,23 +50,56 @@ export default function Home() {
             const timeoutId = setTimeout(() => controller.abort(), 60000); // 60 second timeout
 
             const apiUrl = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
-            const response = await fetch(`${apiUrl}/process-video`, {
+            const response = await fetch(`${apiUrl}/process-video/stream`, {
                 method: 'POST',
                 body: formData,
                 signal: controller.signal,
             });
 
-            clearTimeout(timeoutId);
-
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
+                clearTimeout(timeoutId);
                 throw new Error('Failed to process video');
             }
 
-            const data = await response.json();
-            setTranscription(data.corrected_text);
+            // The backend streams newline-delimited JSON events: partial hypotheses
+            // during decoding, the raw transcript, then the corrected text.
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            let correctedText = '';
+            let rejected = false;
+            while (!rejected) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop() ?? '';
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const event = JSON.parse(line);
+                    if (event.event === 'partial') {
+                        setTranscription(event.text);
+                        setIsProcessing(false);
+                    } else if (event.event === 'raw') {
+                        setTranscription(event.raw_output);
+                        setIsProcessing(false);
+                    } else if (event.event === 'corrected') {
+                        correctedText = event.corrected_text;
+                        setTranscription(correctedText);
+                    } else if (event.event === 'error') {
+                        // The backend is up but could not transcribe this clip (e.g. no face in view)
+                        setTranscription(`I'm sorry, there was an error processing the video: ${event.detail}`);
+                        rejected = true;
+                        await reader.cancel();
+                        break;
+                    }
+                }
+            }
+
+            clearTimeout(timeoutId);
 
-            if (isAutoSpeakEnabled && data.corrected_text) {
-                await playTTS(data.corrected_text);
+            if (isAutoSpeakEnabled && correctedText) {
+                await playTTS(correctedText);
             }
         } catch (error) {
             console.error('Error processing video:', error);
@@ -0,0 +1,35 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+
+import numpy as np
+
+
+# mouth patches as cropped by VideoProcess, or already center-cropped by VideoTransform
+ROI_SIZES = [(96, 96), (88, 88)]
+
+
+def load_array(data, key):
+    """Load an uploaded `.npy` array, or the `key` entry of an `.npz` archive, without unpickling."""
+    try:
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+        if isinstance(array, np.lib.npyio.NpzFile):
+            array = array[key]
+    except (OSError, ValueError, KeyError) as e:
+        raise ValueError(f"not a .npy array or .npz archive with a '{key}' entry ({e})")
+    return array
+
+
+def load_roi_array(data):
+    """Parse mouth ROI frames uploaded as `.npy` (or `.npz` with a `roi` entry) and validate them.
+
+    Expects a uint8 grayscale array of shape (T, 96, 96) or (T, 88, 88) and
+    raises ValueError otherwise.
+    """
+    roi = load_array(data, "roi")
+    if roi.ndim != 3 or roi.shape[1:] not in ROI_SIZES or len(roi) == 0:
+        raise ValueError(f"expected shape (T, 96, 96) or (T, 88, 88), got {roi.shape}")
+    if roi.dtype != np.uint8:
+        raise ValueError(f"expected uint8 pixels, got {roi.dtype}")
+    return roi
@@ -6,12 +6,14 @@
 
 import torch
 import torchaudio
-import torchvision
+from .stream import crop_stream
 from .transforms import AudioTransform, VideoTransform
+from .video_io import open_buffer, read_video
+from pipelines.timing import stage
 
 
 class AVSRDataLoader:
-    def __init__(self, modality, speed_rate=1, transform=True, detector="retinaface", convert_gray=True):
+    def __init__(self, modality, speed_rate=1, transform=True, detector="retinaface", convert_gray=True, max_gap=None):
         self.modality = modality
         self.transform = transform
         if self.modality in ["audio", "audiovisual"]:
@@ -19,46 +21,63 @@ class AVSRDataLoader:
         if self.modality in ["video", "audiovisual"]:
             if detector == "mediapipe":
                 from pipelines.detectors.mediapipe.video_process import VideoProcess
-                self.video_process = VideoProcess(convert_gray=convert_gray)
+                self.video_process = VideoProcess(convert_gray=convert_gray, max_gap=max_gap)
             if detector == "retinaface":
                 from pipelines.detectors.retinaface.video_process import VideoProcess
-                self.video_process = VideoProcess(convert_gray=convert_gray)
+                self.video_process = VideoProcess(convert_gray=convert_gray, max_gap=max_gap)
             self.video_transform = VideoTransform(speed_rate=speed_rate)
 
 
-    def load_data(self, data_filename, landmarks=None, transform=True):
+    def load_data(self, data_filename, landmarks=None, transform=True, video=None):
         if self.modality == "audio":
             audio, sample_rate = self.load_audio(data_filename)
             audio = self.audio_process(audio, sample_rate)
-            return self.audio_transform(audio) if self.transform else audio
+            with stage("transform"):
+                return self.audio_transform(audio) if self.transform else audio
         if self.modality == "video":
-            video = self.load_video(data_filename)
-            video = self.video_process(video, landmarks)
-            video = torch.tensor(video)
-            return self.video_transform(video) if self.transform else video
+            video = self.load_video(data_filename) if video is None else video
+            with stage("crop"):
+                video = self.video_process(video, landmarks)
+            with stage("transform"):
+                video = torch.tensor(video)
+                return self.video_transform(video) if self.transform else video
         if self.modality == "audiovisual":
             rate_ratio = 640
             audio, sample_rate = self.load_audio(data_filename)
             audio = self.audio_process(audio, sample_rate)
-            video = self.load_video(data_filename)
-            video = self.video_process(video, landmarks)
+            video = self.load_video(data_filename) if video is None else video
+            with stage("crop"):
+                video = self.video_process(video, landmarks)
             video = torch.tensor(video)
             min_t = min(len(video), audio.size(1) // rate_ratio)
             audio = audio[:, :min_t*rate_ratio]
             video = video[:min_t]
             if self.transform:
-                audio = self.audio_transform(audio)
-                video = self.video_transform(video)
+                with stage("transform"):
+                    audio = self.audio_transform(audio)
+                    video = self.video_transform(video)
             return video, audio
 
 
+    def load_video_stream(self, frames_with_landmarks):
+        # crop frames while they are decoded instead of holding every RGB frame of the clip
+        return self.load_roi(crop_stream(self.video_process, frames_with_landmarks))
+
+
+    def load_roi(self, roi):
+        with stage("transform"):
+            video = torch.tensor(roi)
+            return self.video_transform(video) if self.transform else video
+
+
     def load_audio(self, data_filename):
-        waveform, sample_rate = torchaudio.load(data_filename, normalize=True)
+        with stage("decode"):
+            waveform, sample_rate = torchaudio.load(open_buffer(data_filename), normalize=True)
         return waveform, sample_rate
 
 
     def load_video(self, data_filename):
-        return torchvision.io.read_video(data_filename, pts_unit='sec')[0].numpy()
+        return read_video(data_filename)
 
 
     def audio_process(self, waveform, sample_rate, target_sample_rate=16000):
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .arrays import load_array
+
+
+def landmarks_to_array(landmarks):
+    """Pack per-frame landmarks (arrays or None) into a float32 (T, K, 2) array, NaN where missing."""
+    shape = next(np.shape(l) for l in landmarks if l is not None)
+    return np.stack([np.full(shape, np.nan, dtype=np.float32) if l is None else np.asarray(l, dtype=np.float32)
+                     for l in landmarks])
+
+
+def record_landmarks(frames_with_landmarks, landmarks):
+    """Pass (frame, landmarks) pairs through unchanged, appending each frame's landmarks to `landmarks`."""
+    for frame, frame_landmarks in frames_with_landmarks:
+        landmarks.append(frame_landmarks)
+        yield frame, frame_landmarks
+
+
+# keypoints per face produced by each detector: the four MediaPipe face detection
+# keypoints (eyes, nose tip, mouth center) or the 68-point iBUG layout
+NUM_LANDMARKS = {"mediapipe": 4, "retinaface": 68}
+
+
+def array_to_landmarks(array):
+    """Unpack a (T, K, 2) array into per-frame landmarks, None for frames containing NaN."""
+    return [None if np.isnan(frame_landmarks).any() else frame_landmarks for frame_landmarks in array]
+
+
+def load_landmarks(data, num_landmarks):
+    """Parse landmarks uploaded as `.npy` (or `.npz` with a `landmarks` entry) and validate them.
+
+    The array must have shape (T, `num_landmarks`, 2) and hold pixel (x, y)
+    coordinates of each frame, with NaN rows for frames where no face was
+    found. Returns per-frame landmarks as accepted by `VideoProcess`, and
+    raises ValueError if the upload is malformed.
+    """
+    array = load_array(data, "landmarks")
+    if array.ndim != 3 or array.shape[1:] != (num_landmarks, 2):
+        raise ValueError(f"expected shape (T, {num_landmarks}, 2), got {array.shape}")
+    if not np.issubdtype(array.dtype, np.number):
+        raise ValueError(f"expected a numeric array, got {array.dtype}")
+    array = array.astype(np.float32)
+    if np.isinf(array).any():
+        raise ValueError("coordinates must be finite")
+    landmarks = array_to_landmarks(array)
+    if all(frame_landmarks is None for frame_landmarks in landmarks):
+        raise ValueError("no frame has landmarks")
+    return landmarks
+
+
+def attach_landmarks(frames, landmarks):
+    """Pair each frame with its landmarks, raising ValueError if there are more or fewer frames than landmarks."""
+    landmarks = iter(landmarks)
+    for frame in frames:
+        frame_landmarks = next(landmarks, StopIteration)
+        if frame_landmarks is StopIteration:
+            raise ValueError("the video has more frames than there are landmarks")
+        yield frame, frame_landmarks
+    if next(landmarks, StopIteration) is not StopIteration:
+        raise ValueError("the video has fewer frames than there are landmarks")
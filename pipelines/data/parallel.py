@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+_executor = None
+_num_threads = 1
+_lock = threading.Lock()
+
+
+def frame_executor():
+    """Threads shared by all clips for per-frame OpenCV work, which runs without the GIL.
+
+    Sized like OpenCV's own thread pool, so `cv2.setNumThreads` limits both. It
+    is created on first use, i.e. after any fork.
+    """
+    global _executor, _num_threads
+    with _lock:
+        if _executor is None:
+            _num_threads = max(1, cv2.getNumThreads())
+            _executor = ThreadPoolExecutor(max_workers=_num_threads, thread_name_prefix="vsr-frames")
+        return _executor
+
+
+def frame_threads():
+    """Number of threads of `frame_executor`."""
+    frame_executor()
+    return _num_threads
+
+
+def run_chunks(fn, num_items, min_chunk_size=2):
+    """Call `fn(start, stop)` for consecutive chunks of `range(num_items)` in parallel and wait for all of them.
+
+    The items are split evenly over all frame threads, in chunks of at least
+    `min_chunk_size` items so that handing a chunk to a thread does not cost
+    more than the work in it.
+    """
+    num_chunks = min(frame_threads(), num_items // max(1, min_chunk_size))
+    if num_chunks <= 1:
+        fn(0, num_items)
+        return
+    bounds = [num_items * chunk // num_chunks for chunk in range(num_chunks + 1)]
+    futures = [frame_executor().submit(fn, start, stop) for start, stop in zip(bounds, bounds[1:])]
+    for future in futures:
+        future.result()
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+import cv2
+import numpy as np
+
+from pipelines.data.parallel import frame_threads
+from pipelines.timing import stage
+
+
+class StreamingVideoProcess:
+    """Crop mouth patches from a stream of frames using a VideoProcess.
+
+    Frames are pushed one at a time together with their detected landmarks (or
+    None). A frame is cropped once every landmark in its smoothing window is
+    known, i.e. once a face has been detected `window_margin // 2` frames after
+    it, so only a short lookahead of frames is kept in memory instead of the
+    whole clip. Interpolation, edge padding and smoothing match
+    `VideoProcess.__call__` on the full clip.
+    """
+
+    def __init__(self, video_process, chunk_size=None):
+        self.video_process = video_process
+        self.margin = video_process.window_margin // 2
+        # frames cropped together; by default enough to give every frame thread some work
+        self.chunk_size = chunk_size or max(32, 4 * frame_threads())
+        self.frames = deque()
+        self.landmarks = []
+        self.last_valid = None
+        self.num_cropped = 0
+
+    @property
+    def num_frames(self):
+        return len(self.landmarks)
+
+    def push(self, frame, landmarks):
+        """Add the next frame and return the patches that became ready, if any."""
+        with stage("crop"):
+            return self._push(frame, landmarks)
+
+    def _push(self, frame, landmarks):
+        if self.video_process.convert_gray and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        frame_idx = self.num_frames
+        self.frames.append(frame)
+        self.landmarks.append(landmarks)
+        if landmarks is not None:
+            if self.last_valid is None:
+                # frames before the first detection reuse its landmarks
+                self.landmarks[:frame_idx] = [landmarks] * frame_idx
+            elif frame_idx - self.last_valid > 1:
+                self.landmarks[self.last_valid:] = self.video_process.interpolate_landmarks(self.landmarks[self.last_valid:])
+            self.last_valid = frame_idx
+        if self.last_valid is None:
+            return []
+        ready = self.last_valid - self.margin + 1
+        if ready - self.num_cropped < self.chunk_size:
+            return []
+        return self._crop(ready)
+
+    def flush(self):
+        """Crop every remaining frame once the stream has ended."""
+        with stage("crop"):
+            return self._flush()
+
+    def _flush(self):
+        if self.last_valid is None:
+            self.frames.clear()
+            return []
+        # frames after the last detection reuse its landmarks
+        num_trailing = self.num_frames - self.last_valid - 1
+        self.landmarks[self.last_valid + 1:] = [self.landmarks[self.last_valid]] * num_trailing
+        return self._crop(self.num_frames)
+
+    def _crop(self, stop):
+        start = self.num_cropped
+        if stop <= start:
+            return []
+        # smoothing a window that extends `margin` frames on both sides of [start, stop)
+        # gives the same result as smoothing the whole clip
+        window_start = max(0, start - self.margin)
+        window_stop = min(self.num_frames, stop + self.margin)
+        smoothed = self.video_process.smooth_landmarks(self.landmarks[window_start:window_stop])
+        frames = [self.frames.popleft() for _ in range(stop - start)]
+        self.num_cropped = stop
+        return list(self.video_process.crop_frames(frames, smoothed[start - window_start:stop - window_start]))
+
+
+def crop_stream(video_process, frames_with_landmarks, chunk_size=None):
+    """Crop all frames of an iterable of (frame, landmarks) pairs into a (T, H, W) patch array."""
+    stream = StreamingVideoProcess(video_process, chunk_size=chunk_size)
+    patches = []
+    for frame, landmarks in frames_with_landmarks:
+        patches.extend(stream.push(frame, landmarks))
+    patches.extend(stream.flush())
+    assert patches, "cannot crop a patch from the video stream"
+    # the same minimum as VideoProcess applies to the whole clip
+    assert len(patches) >= video_process.min_frames, f"cannot crop a patch from a clip of {len(patches)} frames"
+    return np.stack(patches)
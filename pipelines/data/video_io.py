@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+
+import av
+import cv2
+import numpy as np
+import torchvision
+
+from pipelines.timing import record, stage, timed_iter
+
+
+def open_buffer(source):
+    # bytes-like sources get a fresh reader per call so they can be decoded more than once
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def read_video(source):
+    """Decode every frame of a video into an RGB uint8 array of shape (T, H, W, 3).
+
+    `source` is either a path on disk or the encoded video itself, given as a
+    bytes-like object or a readable binary file object; in-memory sources are
+    decoded with PyAV without touching the filesystem.
+    """
+    with stage("decode"):
+        if isinstance(source, str):
+            video = torchvision.io.read_video(source, pts_unit='sec')[0].numpy()
+        else:
+            with av.open(open_buffer(source)) as container:
+                frames = [frame.to_ndarray(format="rgb24") for frame in container.decode(video=0)]
+            if not frames:
+                raise ValueError("no video frames could be decoded")
+            video = np.stack(frames)
+    record("frames", len(video))
+    return video
+
+
+def iter_video_frames(source):
+    """Yield the RGB uint8 frames (H, W, 3) of a video one at a time while it is decoded.
+
+    Accepts the same sources as `read_video`, but never holds more than one
+    decoded frame, so long clips can be processed with bounded memory.
+    """
+    with stage("decode"):
+        container = av.open(source if isinstance(source, str) else open_buffer(source))
+    num_frames = 0
+    with container:
+        frames = (frame.to_ndarray(format="rgb24") for frame in container.decode(video=0))
+        for num_frames, frame in enumerate(timed_iter("decode", frames), 1):
+            yield frame
+        frame_rate = container.streams.video[0].average_rate
+    record("frames", num_frames)
+    if frame_rate:
+        record("clip_seconds", num_frames / float(frame_rate))
+
+
+def decode_image(data):
+    """Decode one encoded still image (JPEG, PNG, ...) into an RGB uint8 array of shape (H, W, 3)."""
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("frame could not be decoded as an image")
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
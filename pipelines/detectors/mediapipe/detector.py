@@ -5,7 +5,7 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 import warnings
-import torchvision
+from pipelines.data.video_io import read_video
 import mediapipe as mp
 import os
 import cv2
@@ -18,14 +18,39 @@ class LandmarksDetector:
         self.short_range_detector = self.mp_face_detection.FaceDetection(min_detection_confidence=0.5, model_selection=0)
         self.full_range_detector = self.mp_face_detection.FaceDetection(min_detection_confidence=0.5, model_selection=1)
 
-    def __call__(self, filename):
-        video_frames = torchvision.io.read_video(filename, pts_unit='sec')[0].numpy()
+    def __call__(self, video):
+        # accept frames that were already decoded so the clip is only decoded once
+        video_frames = video if isinstance(video, np.ndarray) else read_video(video)
         landmarks = self.detect(video_frames, self.full_range_detector)
         if all(element is None for element in landmarks):
             landmarks = self.detect(video_frames, self.short_range_detector)
             assert any(l is not None for l in landmarks), "Cannot detect any frames in the video"
         return landmarks
 
+    def stream(self, frames):
+        """Yield (frame, landmarks) pairs for an iterable of frames.
+
+        Gives the same landmarks as `__call__`: the full-range detector is used
+        unless it finds no face in the whole clip, in which case the short-range
+        detections are used. Frames are held back only until the full-range
+        detector first finds a face.
+        """
+        held = []
+        for frame in frames:
+            landmarks = self.detect([frame], self.full_range_detector)[0]
+            if landmarks is None and held is not None:
+                held.append((frame, self.detect([frame], self.short_range_detector)[0]))
+                continue
+            if held:
+                # the full-range detector found nothing in these frames
+                for held_frame, _ in held:
+                    yield held_frame, None
+            held = None
+            yield frame, landmarks
+        if held is not None:
+            assert any(l is not None for _, l in held), "Cannot detect any frames in the video"
+            yield from held
+
     def detect(self, video_frames, detector):
         landmarks = []
         for frame in video_frames:
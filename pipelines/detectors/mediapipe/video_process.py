@@ -9,14 +9,11 @@ import cv2
 import numpy as np
 from skimage import transform as tf
 
+from pipelines.data.parallel import run_chunks
 
-def linear_interpolate(landmarks, start_idx, stop_idx):
-    start_landmarks = landmarks[start_idx]
-    stop_landmarks = landmarks[stop_idx]
-    delta = stop_landmarks - start_landmarks
-    for idx in range(1, stop_idx-start_idx):
-        landmarks[start_idx+idx] = start_landmarks + idx/float(stop_idx-start_idx) * delta
-    return landmarks
+
+# default of arguments that fall back to the VideoProcess setting, where None is a valid value
+_from_instance = object()
 
 
 def warp_img(src, dst, img, std_size):
@@ -32,26 +29,35 @@ def apply_transform(transform, img, std_size):
     return warped
 
 
-def cut_patch(img, landmarks, height, width, threshold=5):
+def patch_bounds(landmarks, image_shape, height, width, threshold=5):
     center_x, center_y = np.mean(landmarks, axis=0)
     # Check for too much bias in height and width
-    if abs(center_y - img.shape[0] / 2) > height + threshold:
+    if abs(center_y - image_shape[0] / 2) > height + threshold:
         raise Exception('too much bias in height')
-    if abs(center_x - img.shape[1] / 2) > width + threshold:
+    if abs(center_x - image_shape[1] / 2) > width + threshold:
         raise Exception('too much bias in width')
     # Calculate bounding box coordinates
-    y_min = int(round(np.clip(center_y - height, 0, img.shape[0])))
-    y_max = int(round(np.clip(center_y + height, 0, img.shape[0])))
-    x_min = int(round(np.clip(center_x - width, 0, img.shape[1])))
-    x_max = int(round(np.clip(center_x + width, 0, img.shape[1])))
-    # Cut the image
-    cutted_img = np.copy(img[y_min:y_max, x_min:x_max])
-    return cutted_img
+    y_min = int(round(np.clip(center_y - height, 0, image_shape[0])))
+    y_max = int(round(np.clip(center_y + height, 0, image_shape[0])))
+    x_min = int(round(np.clip(center_x - width, 0, image_shape[1])))
+    x_max = int(round(np.clip(center_x + width, 0, image_shape[1])))
+    return x_min, y_min, x_max, y_max
+
+
+class AffineEstimator:
+    """Estimates the transform that aligns a frame's stable landmarks with the stable reference points."""
+
+    def __init__(self, stable_reference, stable_points):
+        self.stable_reference = stable_reference
+        self.stable_points = np.asarray(stable_points)
+
+    def __call__(self, landmarks):
+        return cv2.estimateAffinePartial2D(landmarks[self.stable_points], self.stable_reference, method=cv2.LMEDS)[0]
 
 
 class VideoProcess:
     def __init__(self, mean_face_path="20words_mean_face.npy", crop_width=96, crop_height=96,
-                 start_idx=3, stop_idx=4, window_margin=12, convert_gray=True):
+                 start_idx=3, stop_idx=4, window_margin=12, convert_gray=True, max_gap=None):
         self.reference = np.load(os.path.join(os.path.dirname(__file__), mean_face_path))
         self.crop_width = crop_width
         self.crop_height = crop_height
@@ -59,12 +65,20 @@ class VideoProcess:
         self.stop_idx = stop_idx
         self.window_margin = window_margin
         self.convert_gray = convert_gray
+        # shorter clips are rejected
+        self.min_frames = 1
+        # gaps of more missing frames than this are not interpolated (None: no limit)
+        self.max_gap = max_gap
+        # the stable reference only depends on the reference face and the sizes, so it is set up
+        # once per configuration instead of for every frame
+        self.estimators = {}
+        self.get_estimator(self.reference, (0, 1, 2, 3), (256, 256), (256, 256))
 
     def __call__(self, video, landmarks):
         # Pre-process landmarks: interpolate frames that are not detected
         preprocessed_landmarks = self.interpolate_landmarks(landmarks)
         # Exclude corner cases: no landmark in all frames
-        if not preprocessed_landmarks:
+        if preprocessed_landmarks is None:
             return
         # Affine transformation and crop patch
         sequence = self.crop_patch(video, preprocessed_landmarks)
@@ -73,49 +87,113 @@ class VideoProcess:
 
 
     def crop_patch(self, video, landmarks):
-        sequence = []
-        for frame_idx, frame in enumerate(video):
-            window_margin = min(self.window_margin // 2, frame_idx, len(landmarks) - 1 - frame_idx)
-            smoothed_landmarks = np.mean([landmarks[x] for x in range(frame_idx - window_margin, frame_idx + window_margin + 1)], axis=0)
-            smoothed_landmarks += landmarks[frame_idx].mean(axis=0) - smoothed_landmarks.mean(axis=0)
-            transformed_frame, transformed_landmarks = self.affine_transform(frame,smoothed_landmarks,self.reference,grayscale=self.convert_gray)
-            patch = cut_patch(transformed_frame, transformed_landmarks[self.start_idx:self.stop_idx], self.crop_height//2, self.crop_width//2,)
-            sequence.append(patch)
-        return np.array(sequence)
-
+        return self.crop_frames(video, self.smooth_landmarks(landmarks))
+
+
+    def smooth_landmarks(self, landmarks):
+        # centered moving average over (T, K, 2) landmarks; the window shrinks towards both ends of the clip
+        landmarks = np.asarray(landmarks, dtype=np.float64)
+        num_frames = len(landmarks)
+        margin = self.window_margin // 2
+        smoothed = np.empty_like(landmarks)
+        # a sum per window rather than a running sum, so a frame's result only depends on its own
+        # window and cropping a clip in chunks gives exactly the same patches as in one go
+        if num_frames > 2 * margin:
+            windows = np.lib.stride_tricks.sliding_window_view(landmarks, 2 * margin + 1, axis=0)
+            smoothed[margin:num_frames - margin] = windows.mean(axis=-1)
+        for frame_idx in np.r_[0:min(margin, num_frames), max(margin, num_frames - margin):num_frames]:
+            window_margin = min(margin, frame_idx, num_frames - 1 - frame_idx)
+            smoothed[frame_idx] = landmarks[frame_idx - window_margin:frame_idx + window_margin + 1].mean(axis=0)
+        smoothed += landmarks.mean(axis=1, keepdims=True) - smoothed.mean(axis=1, keepdims=True)
+        return smoothed
+
+
+    def crop_frames(self, video, smoothed_landmarks):
+        num_frames = min(len(video), len(smoothed_landmarks))
+        if num_frames == 0:
+            return np.array([])
+        channels = () if self.convert_gray or video[0].ndim == 2 else video[0].shape[2:]
+        sequence = np.empty((num_frames, self.crop_height, self.crop_width) + channels, dtype=video[0].dtype)
+
+        def crop_chunk(start, stop):
+            for frame_idx in range(start, stop):
+                frame = video[frame_idx]
+                if self.convert_gray and frame.ndim == 3:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+                self.warp_patch(frame, smoothed_landmarks[frame_idx], sequence[frame_idx])
+
+        # transform estimation and warping of different frames are independent and OpenCV
+        # releases the GIL, so chunks of frames are cropped in parallel
+        run_chunks(crop_chunk, num_frames)
+        return sequence
 
-    def interpolate_landmarks(self, landmarks):
-        valid_frames_idx = [idx for idx, lm in enumerate(landmarks) if lm is not None]
 
-        if not valid_frames_idx:
+    def warp_patch(self, frame, landmarks, patch, target_size=(256, 256), reference_size=(256, 256), stable_points=(0, 1, 2, 3),
+                   interpolation=cv2.INTER_LINEAR, border_mode=cv2.BORDER_CONSTANT, border_value=0):
+        # the mouth patch of the frame aligned to the reference face, but only the patch is warped:
+        # the transform is shifted so the patch's top left corner lands on the origin
+        transform = self.get_estimator(self.reference, stable_points, reference_size, target_size)(landmarks)
+        mouth = np.matmul(landmarks[self.start_idx:self.stop_idx], transform[:, :2].transpose()) + transform[:, 2].transpose()
+        x_min, y_min, x_max, y_max = patch_bounds(mouth, (target_size[1], target_size[0]), self.crop_height//2, self.crop_width//2)
+        if (y_max - y_min, x_max - x_min) != patch.shape[:2]:
+            raise Exception('patch exceeds the transformed frame')
+        transform[:, 2] -= (x_min, y_min)
+        cv2.warpAffine(frame, transform, dsize=(x_max - x_min, y_max - y_min), dst=patch,
+                       flags=interpolation, borderMode=border_mode, borderValue=border_value)
+        return patch
+
+
+    def interpolate_landmarks(self, landmarks, max_gap=_from_instance):
+        # landmarks are per-frame (K, 2) arrays with None for frames without a face, or a (T, K, 2)
+        # array with NaN rows; returns a (T, K, 2) array with every frame filled, None without any face
+        if isinstance(landmarks, np.ndarray):
+            dense = landmarks.astype(np.float64)
+            valid = ~np.isnan(dense).any(axis=(1, 2))
+        else:
+            valid = np.array([lm is not None for lm in landmarks], dtype=bool)
+            if not valid.any():
+                return None
+            dense = np.empty((len(landmarks),) + np.shape(landmarks[valid.argmax()]))
+            dense[valid] = [lm for lm in landmarks if lm is not None]
+        valid_frames_idx = np.flatnonzero(valid)
+        if len(valid_frames_idx) == 0:
             return None
-
-        for idx in range(1, len(valid_frames_idx)):
-            if valid_frames_idx[idx] - valid_frames_idx[idx - 1] > 1:
-                landmarks = linear_interpolate(landmarks, valid_frames_idx[idx - 1], valid_frames_idx[idx])
-
-        valid_frames_idx = [idx for idx, lm in enumerate(landmarks) if lm is not None]
-
-        # Handle corner case: keep frames at the beginning or at the end that failed to be detected
-        if valid_frames_idx:
-            landmarks[:valid_frames_idx[0]] = [landmarks[valid_frames_idx[0]]] * valid_frames_idx[0]
-            landmarks[valid_frames_idx[-1]:] = [landmarks[valid_frames_idx[-1]]] * (len(landmarks) - valid_frames_idx[-1])
-
-        assert all(lm is not None for lm in landmarks), "not every frame has landmark"
-
-        return landmarks
-
-
-    def affine_transform(self, frame, landmarks, reference, grayscale=False,
-                         target_size=(256, 256), reference_size=(256, 256), stable_points=(0, 1, 2, 3),
-                         interpolation=cv2.INTER_LINEAR, border_mode=cv2.BORDER_CONSTANT, border_value=0):
-        if grayscale:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        stable_reference = self.get_stable_reference(reference, reference_size, target_size)
-        transform = self.estimate_affine_transform(landmarks, stable_points, stable_reference)
-        transformed_frame, transformed_landmarks = self.apply_affine_transform(frame, landmarks, transform, target_size, interpolation, border_mode, border_value)
-
-        return transformed_frame, transformed_landmarks
+        missing = np.flatnonzero(~valid)
+        if len(missing) == 0:
+            return dense
+
+        # the detections on both sides of every missing frame; frames before the first or after
+        # the last detection get both sides from it, i.e. keep its landmarks
+        after = np.searchsorted(valid_frames_idx, missing)
+        start_idx = valid_frames_idx[np.maximum(after - 1, 0)]
+        stop_idx = valid_frames_idx[np.minimum(after, len(valid_frames_idx) - 1)]
+        # on (frames, K * 2) rows and in place, to keep the temporaries few and contiguous
+        flat = dense.reshape(len(dense), -1)
+        start_landmarks = flat[start_idx]
+        filled = flat[stop_idx]
+        filled -= start_landmarks
+        filled *= ((missing - start_idx) / np.maximum(stop_idx - start_idx, 1))[:, None]
+        filled += start_landmarks
+
+        if max_gap is _from_instance:
+            max_gap = self.max_gap
+        if max_gap is not None:
+            # across longer gaps each frame keeps the landmarks of the nearest detection
+            nearest = np.where((missing - start_idx <= stop_idx - missing)[:, None], start_landmarks, flat[stop_idx])
+            filled = np.where((stop_idx - start_idx - 1 > max_gap)[:, None], nearest, filled)
+        flat[missing] = filled
+        return dense
+
+
+    def get_estimator(self, reference, stable_points, reference_size, target_size):
+        # estimators for the own reference face are kept, one per configuration
+        key = (tuple(stable_points), tuple(reference_size), tuple(target_size))
+        if reference is self.reference and key in self.estimators:
+            return self.estimators[key]
+        estimator = AffineEstimator(self.get_stable_reference(reference, reference_size, target_size), stable_points)
+        if reference is self.reference:
+            self.estimators[key] = estimator
+        return estimator
 
 
     def get_stable_reference(self, reference, reference_size, target_size):
@@ -129,14 +207,3 @@ class VideoProcess:
         stable_reference[:, 0] -= (reference_size[0] - target_size[0]) / 2.0
         stable_reference[:, 1] -= (reference_size[1] - target_size[1]) / 2.0
         return stable_reference
-
-
-    def estimate_affine_transform(self, landmarks, stable_points, stable_reference):
-        return cv2.estimateAffinePartial2D(np.vstack([landmarks[x] for x in stable_points]), stable_reference, method=cv2.LMEDS)[0]
-
-
-    def apply_affine_transform(self, frame, landmarks, transform, target_size, interpolation, border_mode, border_value):
-        transformed_frame = cv2.warpAffine(frame, transform, dsize=(target_size[0], target_size[1]),
-                                           flags=interpolation, borderMode=border_mode, borderValue=border_value)
-        transformed_landmarks = np.matmul(landmarks, transform[:, :2].transpose()) + transform[:, 2].transpose()
-        return transformed_frame, transformed_landmarks
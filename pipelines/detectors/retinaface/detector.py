@@ -5,7 +5,8 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 import warnings
-import torchvision
+import numpy as np
+from pipelines.data.video_io import read_video
 from ibug.face_detection import RetinaFacePredictor
 from ibug.face_alignment import FANPredictor
 warnings.filterwarnings("ignore")
@@ -20,19 +21,22 @@ class LandmarksDetector:
         )
         self.landmark_detector = FANPredictor(device=device, model=None)
 
-    def __call__(self, filename):
-        video_frames = torchvision.io.read_video(filename, pts_unit='sec')[0].numpy()
-        landmarks = []
-        for frame in video_frames:
+    def __call__(self, video):
+        # accept frames that were already decoded so the clip is only decoded once
+        video_frames = video if isinstance(video, np.ndarray) else read_video(video)
+        return [landmarks for _, landmarks in self.stream(video_frames)]
+
+    def stream(self, frames):
+        """Yield (frame, landmarks) pairs for an iterable of frames."""
+        for frame in frames:
             detected_faces = self.face_detector(frame, rgb=False)
             face_points, _ = self.landmark_detector(frame, detected_faces, rgb=True)
             if len(detected_faces) == 0:
-                landmarks.append(None)
+                yield frame, None
             else:
                 max_id, max_size = 0, 0
                 for idx, bbox in enumerate(detected_faces):
                     bbox_size = (bbox[2] - bbox[0]) + (bbox[3] - bbox[1])
                     if bbox_size > max_size:
                         max_id, max_size = idx, bbox_size
-                landmarks.append(face_points[max_id])
-        return landmarks
+                yield frame, face_points[max_id]
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+
+import numpy as np
+
+from pipelines.data.stream import StreamingVideoProcess
+from pipelines.data.video_io import decode_image
+
+
+class LiveSession:
+    """Incremental preprocessing of one live utterance.
+
+    Encoded frames are handed over with `push` (from any thread, typically the
+    event loop) and decoded, run through the landmark detector and cropped on
+    the thread that calls `run`, while they keep arriving. When the stream ends
+    only the last lookahead window is left to crop, so the time from the end of
+    the utterance to a transcript no longer grows with its length. The mouth
+    ROI cropped so far is available from `snapshot` for partial transcripts.
+    """
+
+    def __init__(self, pipeline, chunk_size=8, max_pending=256):
+        assert pipeline.modality == "video", "live sessions only support the video modality"
+        self.pipeline = pipeline
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.frames = queue.Queue()
+        self.patches = []
+        self.lock = threading.Lock()
+        self.num_dropped = 0
+
+    @property
+    def num_patches(self):
+        return len(self.patches)
+
+    def push(self, data):
+        """Queue one encoded frame (JPEG, PNG, ...). Raises queue.Full if `run` falls behind."""
+        if self.frames.qsize() >= self.max_pending:
+            raise queue.Full
+        self.frames.put(data)
+
+    def close(self):
+        """Mark the end of the utterance; `run` returns once the queued frames are processed."""
+        self.frames.put(None)
+
+    def snapshot(self, max_frames=None):
+        """Return the mouth ROI cropped so far (its last `max_frames` frames) as a (T, H, W) array, or None."""
+        with self.lock:
+            patches = self.patches[-max_frames:] if max_frames else self.patches
+            return np.stack(patches) if patches else None
+
+    def run(self):
+        """Process frames until `close` and return the mouth ROI of the whole utterance."""
+        stream = StreamingVideoProcess(self.pipeline.dataloader.video_process, chunk_size=self.chunk_size)
+        for frame, landmarks in self.pipeline.landmarks_detector.stream(self._decoded_frames()):
+            self._extend(stream.push(frame, landmarks))
+        self._extend(stream.flush())
+        assert self.patches, "cannot crop a patch from the live stream"
+        assert len(self.patches) >= stream.video_process.min_frames, \
+            f"cannot crop a patch from an utterance of {len(self.patches)} frames"
+        return np.stack(self.patches)
+
+    def _decoded_frames(self):
+        for data in iter(self.frames.get, None):
+            try:
+                yield decode_image(data)
+            except ValueError:
+                # a corrupt frame is dropped instead of ending the utterance
+                self.num_dropped += 1
+
+    def _extend(self, patches):
+        if patches:
+            with self.lock:
+                self.patches.extend(patches)
@@ -6,17 +6,28 @@
 
 import os
 import json
+import time
 import torch
+import threading
+import weakref
 import argparse
 import numpy as np
 
-from espnet.asr.asr_utils import torch_load
 from espnet.asr.asr_utils import get_model_conf
 from espnet.asr.asr_utils import add_results_to_json
 from espnet.nets.batch_beam_search import BatchBeamSearch
 from espnet.nets.lm_interface import dynamic_import_lm
 from espnet.nets.scorers.length_bonus import LengthBonus
 from espnet.nets.pytorch_backend.e2e_asr_transformer import E2E
+from pipelines.profiler import SampledProfiler
+from pipelines.timing import record, stage
+from pipelines.weights import load_weights
+
+
+# language models already loaded, shared by every pipeline decoding with the same checkpoint;
+# they only hold weights (the decoding state lives in the beam search), so sharing is safe
+_language_models = weakref.WeakValueDictionary()
+_language_models_lock = threading.Lock()
 
 
 class AVSR(torch.nn.Module):
@@ -44,23 +55,105 @@ class AVSR(torch.nn.Module):
         self.odim = len(self.token_list)
 
         self.model = E2E(self.odim, self.train_args)
-        self.model.load_state_dict(torch.load(model_path, map_location=lambda storage, loc: storage))
+        load_weights(model_path, self.model)
         self.model.to(device=self.device).eval()
 
         self.beam_search = get_beam_search_decoder(self.model, self.token_list, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size)
         self.beam_search.to(device=self.device).eval()
+        # disabled until a sample rate is configured
+        self.profiler = SampledProfiler()
         
-    def infer(self, data):
+    def infer(self, data, callback=None):
+        with self.profiler.profile("infer"), torch.no_grad():
+            with stage("encode"):
+                if isinstance(data, tuple):
+                    enc_feats = self.model.encode(data[0].to(self.device), data[1].to(self.device))
+                else:
+                    enc_feats = self.model.encode(data.to(self.device))
+            return self.decode(enc_feats, callback)
+
+
+    def infer_batch(self, batch, callbacks=None, on_result=None):
+        # callbacks[i], if given, receives partial transcripts of batch[i] during beam search, and
+        # on_result(i, transcript) is called as soon as batch[i] is decoded, before the next clip is
+        callbacks = callbacks or [None] * len(batch)
+        results = []
+        # audio-visual inputs and single clips go through the regular path
+        if len(batch) == 1 or any(isinstance(data, tuple) for data in batch):
+            for data, callback in zip(batch, callbacks):
+                results.append(self.infer(data, callback))
+                if on_result:
+                    on_result(len(results) - 1, results[-1])
+            return results
+        with self.profiler.profile(f"infer_batch{len(batch)}"), torch.no_grad():
+            with stage("encode"):
+                enc_feats = self.model.encode_batch([data.to(self.device) for data in batch])
+            for feats, callback in zip(enc_feats, callbacks):
+                results.append(self.decode(feats, callback))
+                if on_result:
+                    on_result(len(results) - 1, results[-1])
+        return results
+
+
+    def infer_greedy(self, data):
+        # CTC best path decoding, a fraction of the cost of the beam search
         with torch.no_grad():
-            if isinstance(data, tuple):
-                enc_feats = self.model.encode(data[0].to(self.device), data[1].to(self.device))
-            else:
-                enc_feats = self.model.encode(data.to(self.device))
-            nbest_hyps = self.beam_search(enc_feats)
+            enc_feats = self.model.encode(data.to(self.device))
+            token_ids = torch.unique_consecutive(self.model.ctc.argmax(enc_feats.unsqueeze(0))[0])
+        text = "".join(self.token_list[int(x)] for x in token_ids if x != 0)
+        return text.replace("▁", " ").replace("<eos>", "").strip()
+
+
+    def decode(self, enc_feats, callback=None):
+        with stage("beam"):
+            nbest_hyps = self.beam_search(enc_feats, partial_callback=self.step_callback(callback))
+        with stage("detokenize"):
             nbest_hyps = [h.asdict() for h in nbest_hyps[: min(len(nbest_hyps), 1)]]
             transcription = add_results_to_json(nbest_hyps, self.token_list)
             transcription = transcription.replace("▁", " ").strip()
-        return transcription.replace("<eos>", "")
+            return transcription.replace("<eos>", "")
+
+
+    def step_callback(self, callback=None):
+        # record how long every beam search step takes and pass partial transcripts on to `callback`
+        partial_callback = self.partial_callback(callback) if callback else None
+        last_step = [time.perf_counter()]
+        def on_step(yseq):
+            now = time.perf_counter()
+            record("beam_step", now - last_step[0])
+            if partial_callback:
+                partial_callback(yseq)
+            last_step[0] = time.perf_counter()
+        return on_step
+
+
+    def partial_callback(self, callback):
+        # turn the best running token sequence into text, reporting only when it changes
+        last = [None]
+        def on_step(yseq):
+            text = "".join(self.token_list[int(x)] for x in yseq[1:])
+            text = text.replace("▁", " ").replace("<eos>", "").strip()
+            if text and text != last[0]:
+                last[0] = text
+                callback(text)
+        return on_step
+
+
+def load_language_model(rnnlm, rnnlm_conf, vocab_size):
+    # a checkpoint replaced in place is loaded anew
+    stat = os.stat(rnnlm)
+    key = (os.path.realpath(rnnlm), stat.st_size, stat.st_mtime_ns, rnnlm_conf and os.path.realpath(rnnlm_conf), vocab_size)
+    with _language_models_lock:
+        lm = _language_models.get(key)
+        if lm is None:
+            lm_args = get_model_conf(rnnlm, rnnlm_conf)
+            lm_model_module = getattr(lm_args, "model_module", "default")
+            lm_class = dynamic_import_lm(lm_model_module, lm_args.backend)
+            lm = lm_class(vocab_size, lm_args)
+            load_weights(rnnlm, lm)
+            lm.eval()
+            _language_models[key] = lm
+        return lm
 
 
 def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, penalty=0, ctc_weight=0.1, lm_weight=0., beam_size=40):
@@ -71,12 +164,7 @@ def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, pena
     if not rnnlm:
         lm = None
     else:
-        lm_args = get_model_conf(rnnlm, rnnlm_conf)
-        lm_model_module = getattr(lm_args, "model_module", "default")
-        lm_class = dynamic_import_lm(lm_model_module, lm_args.backend)
-        lm = lm_class(len(token_list), lm_args)
-        torch_load(rnnlm, lm)
-        lm.eval()
+        lm = load_language_model(rnnlm, rnnlm_conf, len(token_list))
 
     scorers["lm"] = lm
     scorers["length_bonus"] = LengthBonus(len(token_list))
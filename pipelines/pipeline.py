@@ -6,15 +6,46 @@
 
 import os
 import torch
+import numpy as np
 import pickle
+import hashlib
+import threading
 from configparser import ConfigParser
 
+from pipelines.live import LiveSession
 from pipelines.model import AVSR
 from pipelines.data.data_module import AVSRDataLoader
+from pipelines.data.landmarks import NUM_LANDMARKS, attach_landmarks, landmarks_to_array, record_landmarks
+from pipelines.data.stream import crop_stream
+from pipelines.data.video_io import iter_video_frames
+from pipelines.timing import stage, timed_iter
+
+
+# landmarks detectors of the current thread by detector name, shared by all pipelines
+_detectors = threading.local()
+
+# part of the fingerprint of cached landmarks and mouth ROI; bump it whenever a change
+# to detection or cropping changes their output, so stale entries are not served
+PREPROCESS_VERSION = 2
+# VideoProcess settings that change the cropped mouth ROI
+CROP_SETTINGS = ("crop_width", "crop_height", "start_idx", "stop_idx", "window_margin", "convert_gray", "max_gap")
+
+
+def config_fingerprint(config_filename, paths, *extra):
+    # hash of the config plus the size and mtime of the files it points to,
+    # so replacing a checkpoint in place yields a new fingerprint
+    digest = hashlib.sha256(open(config_filename, "rb").read())
+    for path in paths:
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    for value in extra:
+        digest.update(str(value).encode())
+    return digest.hexdigest()[:16]
 
 
 class InferencePipeline(torch.nn.Module):
-    def __init__(self, config_filename, detector="retinaface", face_track=False, device="cuda:0"):
+    def __init__(self, config_filename, detector="retinaface", face_track=False, device="cuda:0", eager_detector=True):
         super(InferencePipeline, self).__init__()
         assert os.path.isfile(config_filename), f"config_filename: {config_filename} does not exist."
 
@@ -27,6 +58,8 @@ class InferencePipeline(torch.nn.Module):
         self.modality = modality
         # data configuration
         input_v_fps = config.getfloat("input", "v_fps")
+        # frames without a face across which landmarks are interpolated, longer gaps hold the nearest detection
+        max_gap = config.getint("input", "max_gap", fallback=None)
         model_v_fps = config.getfloat("model", "v_fps")
 
         # model configuration
@@ -41,33 +74,135 @@ class InferencePipeline(torch.nn.Module):
         lm_weight = config.getfloat("decode", "lm_weight")
         beam_size = config.getint("decode", "beam_size")
 
-        self.dataloader = AVSRDataLoader(modality, speed_rate=input_v_fps/model_v_fps, detector=detector)
+        self.dataloader = AVSRDataLoader(modality, speed_rate=input_v_fps/model_v_fps, detector=detector, max_gap=max_gap)
         self.model = AVSR(modality, model_path, model_conf, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size, device)
-        if face_track and self.modality in ["video", "audiovisual"]:
-            if detector == "mediapipe":
-                from pipelines.detectors.mediapipe.detector import LandmarksDetector
-                self.landmarks_detector = LandmarksDetector()
-            if detector == "retinaface":
-                from pipelines.detectors.retinaface.detector import LandmarksDetector
-                self.landmarks_detector = LandmarksDetector(device="cuda:0")
-        else:
-            self.landmarks_detector = None
+        self.detector = detector
+        self.face_track = face_track and self.modality in ["video", "audiovisual"]
+        self.num_landmarks = NUM_LANDMARKS[detector]
+        # identify what produced a result, e.g. for caching: the whole model setup, and preprocessing only
+        self.fingerprint = config_fingerprint(config_filename, [model_path, model_conf, rnnlm, rnnlm_conf], detector)
+        video_process = getattr(self.dataloader, "video_process", None)
+        crop_settings = {name: getattr(video_process, name, None) for name in CROP_SETTINGS} if video_process else {}
+        self.preprocess_fingerprint = "{}-{}-v{}-{}".format(
+            modality, detector, PREPROCESS_VERSION, hashlib.sha256(repr(sorted(crop_settings.items())).encode()).hexdigest()[:8])
+        # build the detector for the loading thread up front so a broken setup fails at startup;
+        # a process that forks workers after loading skips this, detector graphs do not survive a fork
+        if self.face_track and eager_detector:
+            self.landmarks_detector
+
+
+    @property
+    def landmarks_detector(self):
+        if not self.face_track:
+            return None
+        # detectors keep per-graph state and are not safe to share between threads, so each
+        # thread gets its own, which every pipeline using the same detector runs on that thread
+        detector = getattr(_detectors, self.detector, None)
+        if detector is None:
+            detector = self.build_landmarks_detector()
+            setattr(_detectors, self.detector, detector)
+        return detector
+
+
+    def build_landmarks_detector(self):
+        if self.detector == "mediapipe":
+            from pipelines.detectors.mediapipe.detector import LandmarksDetector
+            return LandmarksDetector()
+        if self.detector == "retinaface":
+            from pipelines.detectors.retinaface.detector import LandmarksDetector
+            return LandmarksDetector(device="cuda:0")
 
 
-    def process_landmarks(self, data_filename, landmarks_filename):
+    def process_landmarks(self, video, landmarks_filename):
         if self.modality == "audio":
             return None
         if self.modality in ["video", "audiovisual"]:
             if isinstance(landmarks_filename, str):
                 landmarks = pickle.load(open(landmarks_filename, "rb"))
+            elif landmarks_filename is not None:
+                # landmarks computed by the caller, one entry per frame
+                if len(landmarks_filename) != len(video):
+                    raise ValueError(f"got landmarks for {len(landmarks_filename)} frames, the video has {len(video)}")
+                landmarks = landmarks_filename
             else:
-                landmarks = self.landmarks_detector(data_filename)
+                with stage("detect"):
+                    landmarks = self.landmarks_detector(video)
             return landmarks
 
 
+    def load_data(self, data_filename, landmarks_filename=None, intermediates=None):
+        # data_filename may also be the encoded video itself (bytes or a binary file object), and
+        # landmarks_filename a pickle path or per-frame landmarks already computed by the caller
+        if isinstance(data_filename, str):
+            assert os.path.isfile(data_filename), f"data_filename: {data_filename} does not exist."
+        if self.modality == "video":
+            return self.load_video_stream(data_filename, landmarks_filename, intermediates)
+        # decode once and share the frames between landmark detection and cropping
+        video = self.dataloader.load_video(data_filename) if self.modality == "audiovisual" else None
+        landmarks = self.process_landmarks(video, landmarks_filename)
+        return self.dataloader.load_data(data_filename, landmarks, video=video)
+
+
+    def load_video_stream(self, data_filename, landmarks_filename=None, intermediates=None):
+        # detection and cropping run frame by frame as the clip is decoded, so memory
+        # stays bounded by a short lookahead window instead of the clip length
+        frames = iter_video_frames(data_filename)
+        if isinstance(landmarks_filename, str):
+            frames_with_landmarks = zip(frames, pickle.load(open(landmarks_filename, "rb")))
+        elif landmarks_filename is not None:
+            frames_with_landmarks = attach_landmarks(frames, landmarks_filename)
+        else:
+            frames_with_landmarks = timed_iter("detect", self.landmarks_detector.stream(frames))
+        if intermediates is None:
+            return self.dataloader.load_video_stream(frames_with_landmarks)
+        # keep the detected landmarks and mouth ROI for the caller
+        landmarks = []
+        roi = crop_stream(self.dataloader.video_process, record_landmarks(frames_with_landmarks, landmarks))
+        intermediates["landmarks"] = landmarks_to_array(landmarks)
+        intermediates["roi"] = roi
+        return self.dataloader.load_roi(roi)
+
+
+    def load_roi(self, roi):
+        return self.dataloader.load_roi(roi)
+
+
+    def infer_batch(self, batch, callbacks=None, on_result=None):
+        return self.model.infer_batch(batch, callbacks, on_result)
+
+
+    def warmup_preprocess(self, num_frames=8, frame_size=(240, 320)):
+        # build this thread's landmarks detector and run it once, so graph setup is not paid by a request
+        if not self.face_track:
+            return
+        frames = np.random.randint(0, 256, (num_frames, *frame_size, 3), dtype=np.uint8)
+        try:
+            self.landmarks_detector(frames)
+        except AssertionError:
+            # no face in the synthetic frames, detection still ran
+            pass
+
+
+    def warmup_model(self, lengths):
+        # run synthetic mouth ROI of each length through the batched and single-clip model paths so
+        # allocator growth and first-call kernel selection happen before the first request
+        for length in sorted(lengths):
+            roi = np.random.randint(0, 256, (length, 96, 96), dtype=np.uint8)
+            data = self.load_roi(roi)
+            self.infer_batch([data, data])
+            self.infer_batch([data])
+
+
+    def live_session(self, **kwargs):
+        return LiveSession(self, **kwargs)
+
+
+    def infer_partial(self, roi):
+        # quick CTC transcript of the latest mouth ROI frames during a live session
+        return self.model.infer_greedy(self.load_roi(roi))
+
+
     def forward(self, data_filename, landmarks_filename=None):
-        assert os.path.isfile(data_filename), f"data_filename: {data_filename} does not exist."
-        landmarks = self.process_landmarks(data_filename, landmarks_filename)
-        data = self.dataloader.load_data(data_filename, landmarks)
+        data = self.load_data(data_filename, landmarks_filename)
         transcript = self.model.infer(data)
         return transcript
\ No newline at end of file
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+
+class SampledProfiler:
+    """Run a random fraction of model calls under the PyTorch profiler.
+
+    Each sampled call is written as a Chrome trace (open it in chrome://tracing
+    or Perfetto) to `trace_dir`, and the oldest traces are deleted once the
+    directory grows beyond `max_bytes`. `sample_rate` can be changed at any
+    time; at 0 the profiler costs one comparison per call.
+    """
+
+    def __init__(self, sample_rate=0.0, trace_dir="profiles", max_bytes=200 * 1024 * 1024):
+        self.sample_rate = sample_rate
+        self.trace_dir = trace_dir
+        self.max_bytes = max_bytes
+        self.num_traces = 0
+        self._local = threading.local()
+
+    def configure(self, sample_rate=None, trace_dir=None, max_bytes=None):
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, sample_rate))
+        if trace_dir is not None:
+            self.trace_dir = trace_dir
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the block as `name` if this call is sampled."""
+        # calls nested in a profiled call are part of its trace
+        if getattr(self._local, "active", False) or random.random() >= self.sample_rate:
+            yield
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._local.active = True
+        try:
+            with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+                yield
+        finally:
+            self._local.active = False
+        self.save(prof, name)
+
+    def save(self, prof, name):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        path = os.path.join(self.trace_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.num_traces}-{name}.json")
+        try:
+            prof.export_chrome_trace(path)
+        except Exception as e:
+            print(f"⚠️ Failed to write profiler trace {path}: {e}", flush=True)
+            return
+        self.num_traces += 1
+        self.rotate()
+
+    def traces(self):
+        """List (path, size) of the stored traces, oldest first."""
+        if not os.path.isdir(self.trace_dir):
+            return []
+        files = []
+        with os.scandir(self.trace_dir) as it:
+            for item in it:
+                if item.name.endswith(".json"):
+                    stat = item.stat()
+                    files.append((stat.st_mtime, item.path, stat.st_size))
+        return [(path, size) for _, path, size in sorted(files)]
+
+    def rotate(self):
+        traces = self.traces()
+        total = sum(size for _, size in traces)
+        for path, size in traces:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+_local = threading.local()
+_observers = []
+
+
+class Trace:
+    """Stage timings and measurements collected by one `trace()` block on one thread."""
+
+    def __init__(self):
+        # exclusive seconds spent in each stage
+        self.stages = defaultdict(float)
+        # measurements, e.g. frame counts or the duration of every beam search step
+        self.values = defaultdict(list)
+
+
+def add_observer(observer):
+    """Call `observer(trace)` whenever a `trace()` block finishes, on the thread that ran it."""
+    _observers.append(observer)
+
+
+@contextmanager
+def trace():
+    """Collect the timings of every stage run on this thread inside the block.
+
+    Yields a `Trace` that is filled in as stages finish and handed to the
+    observers at the end. Stages outside any trace are not timed.
+    """
+    parent = getattr(_local, "trace", None)
+    current = _local.trace = Trace()
+    try:
+        yield current
+    finally:
+        _local.trace = parent
+        for observer in _observers:
+            observer(current)
+
+
+@contextmanager
+def stage(name):
+    """Time the block as stage `name` of the current trace.
+
+    Time spent in a nested stage is only counted for the nested one, so e.g.
+    decoding frames while the detector pulls them is not counted as detection.
+    """
+    current = getattr(_local, "trace", None)
+    if current is None:
+        yield
+        return
+    stack = _local.__dict__.setdefault("stack", [])
+    now = time.perf_counter()
+    if stack:
+        parent = stack[-1]
+        current.stages[parent[0]] += now - parent[1]
+    stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        current.stages[name] += now - stack.pop()[1]
+        if stack:
+            stack[-1][1] = now
+
+
+def timed_iter(name, iterable):
+    """Yield from `iterable`, timing the production of each item as stage `name`."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def current_stages():
+    """Copy of the stage timings of the current trace so far, empty outside any trace."""
+    current = getattr(_local, "trace", None)
+    return dict(current.stages) if current is not None else {}
+
+
+def record(name, value):
+    """Add a measurement to the current trace, if any."""
+    current = getattr(_local, "trace", None)
+    if current is not None:
+        current.values[name].append(value)
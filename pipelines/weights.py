@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Flat, memory-mappable weight files.
+
+A `.flat` file is a magic string, the length of a JSON header, the header
+itself (name -> dtype, shape, offset, nbytes) and the raw tensor data, each
+tensor aligned to 64 bytes. Loading maps the file instead of reading it, so
+the weights are paged in on first use and the pages are shared through the
+page cache by every process serving the same file.
+
+Convert checkpoints once with
+
+    python -m pipelines.weights benchmarks/LRS3/models/LRS3_V_WER19.1/model.pth \
+                                benchmarks/LRS3/language_models/lm_en_subword/model.pth
+
+and point `model_path` / `rnnlm` of the config at the resulting `.flat` files.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+
+import torch
+
+from espnet.asr.asr_utils import torch_load
+
+
+FLAT_SUFFIX = ".flat"
+MAGIC = b"VSRFLAT1"
+ALIGNMENT = 64
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def tensor_bytes(tensor):
+    # raw bytes of any dtype (numpy has no bfloat16), as a flat uint8 tensor
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8)
+
+
+def save_flat(state_dict, path):
+    """Write a state dict of tensors to `path` in the flat format."""
+    tensors = {}
+    entries = {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        data = tensor_bytes(tensor)
+        entries[name] = {
+            "dtype": str(tensor.dtype).replace("torch.", ""),
+            "shape": list(tensor.shape),
+            "offset": offset,
+            "nbytes": data.numel(),
+        }
+        tensors[name] = data
+        offset = align(offset + data.numel())
+    header = json.dumps(entries).encode()
+    data_start = align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, entry in entries.items():
+            f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+            f.write(tensors[name].numpy().tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_flat(path):
+    """Map a flat weight file and return its state dict.
+
+    The tensors are views of a private mapping of the file: nothing is read
+    until a tensor is used, and writing to a tensor copies only the page
+    touched, never the file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a flat weight file")
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        entries = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = align(len(MAGIC) + 8 + header_size)
+
+    state_dict = {}
+    for name, entry in entries.items():
+        dtype = getattr(torch, entry["dtype"])
+        offset = data_start + entry["offset"]
+        if offset + entry["nbytes"] > len(buffer):
+            raise ValueError(f"{path} is truncated at {name}")
+        if entry["nbytes"] == 0:
+            state_dict[name] = torch.empty(entry["shape"], dtype=dtype)
+            continue
+        count = math.prod(entry["shape"])
+        state_dict[name] = torch.frombuffer(buffer, dtype=dtype, count=count, offset=offset).view(entry["shape"])
+    return state_dict
+
+
+def load_weights(path, model):
+    """Load the weights at `path` into `model`, mapping `.flat` files instead of reading them."""
+    if not path.endswith(FLAT_SUFFIX):
+        torch_load(path, model)
+        return
+    state_dict = load_flat(path)
+    try:
+        # use the mapped tensors as the parameters instead of copying them into fresh ones
+        model.load_state_dict(state_dict, assign=True)
+    except TypeError:
+        # torch < 2.1
+        model.load_state_dict(state_dict)
+
+
+def convert(path, output=None):
+    """Convert a `torch.save`d checkpoint (or an espnet snapshot) to a flat file."""
+    output = output or os.path.splitext(path)[0] + FLAT_SUFFIX
+    state_dict = torch.load(path, map_location=lambda storage, loc: storage)
+    if "snapshot" in os.path.basename(path):
+        state_dict = state_dict["model"]
+    save_flat(state_dict, output)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert checkpoints to memory-mappable .flat weight files.")
+    parser.add_argument("checkpoints", nargs="+", help="model.pth files, each written next to itself as model.flat")
+    args = parser.parse_args()
+    for path in args.checkpoints:
+        output = convert(path)
+        print(f"{path} -> {output} ({os.path.getsize(output) / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
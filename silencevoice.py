@@ -1,4 +1,6 @@
 import asyncio
+import hashlib
+import json
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor
@@ -10,9 +12,26 @@ from dotenv import load_dotenv
 from pydantic import BaseModel
 from pynput import keyboard
 
+from correction_cache import CorrectionCache
+
 # Load environment variables
 load_dotenv()
 
+GEMINI_MODEL = "gemini-3-flash-preview"
+CORRECTION_PROMPT = (
+    "You are an assistant that helps make corrections to the output of a lipreading model. "
+    "The text you will receive was transcribed using a video-to-text system that attempts to lipread the subject speaking in the video, so the text will likely be imperfect. "
+    "The input text will also be in all-caps, although your response should be capitalized correctly and should NOT be in all-caps.\n\n"
+    "If something seems unusual, assume it was mistranscribed. Do your best to infer the words actually spoken, and make changes to the mistranscriptions in your response. "
+    "Do not add more words or content, just change the ones that seem to be out of place. "
+    "Do not change the wording of sentences, just individual words that look nonsensical in the context of the sentence.\n\n"
+    "Also, add correct punctuation. ALWAYS end each sentence with '.', '?', or '!'.\n\n"
+    "Return the corrected text in JSON format with 'list_of_changes' and 'corrected_text'.\n\n"
+    "Transcription:\n\n"
+)
+# Cached corrections are only reused for the same prompt and model
+CORRECTION_PROMPT_VERSION = hashlib.sha256((GEMINI_MODEL + CORRECTION_PROMPT).encode()).hexdigest()[:8]
+
 
 class SilenceVoiceOutput(BaseModel):
     list_of_changes: str
@@ -47,6 +66,12 @@ class SilenceVoice:
             print("⚠️ GEMINI_API_KEY not found in environment variables")
             self.client = None
 
+        # cache of corrections for transcripts already sent to Gemini (e.g. short common phrases)
+        self.correction_cache = CorrectionCache(
+            max_entries=int(os.getenv("CORRECTION_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("CORRECTION_CACHE_TTL_S", "86400")),
+        )
+
         # setup asyncio event loop in background thread
         self.loop = asyncio.new_event_loop()
         self.async_thread = ThreadPoolExecutor(max_workers=1)
@@ -88,44 +113,12 @@ class SilenceVoice:
             print("⚠️ Gemini client not configured. Skipping correction.")
             return output
 
-        prompt = (
-            "You are an assistant that helps make corrections to the output of a lipreading model. "
-            "The text you will receive was transcribed using a video-to-text system that attempts to lipread the subject speaking in the video, so the text will likely be imperfect. "
-            "The input text will also be in all-caps, although your response should be capitalized correctly and should NOT be in all-caps.\n\n"
-            "If something seems unusual, assume it was mistranscribed. Do your best to infer the words actually spoken, and make changes to the mistranscriptions in your response. "
-            "Do not add more words or content, just change the ones that seem to be out of place. "
-            "Do not change the wording of sentences, just individual words that look nonsensical in the context of the sentence.\n\n"
-            "Also, add correct punctuation. ALWAYS end each sentence with '.', '?', or '!'.\n\n"
-            "Return the corrected text in JSON format with 'list_of_changes' and 'corrected_text'.\n\n"
-            f"Transcription:\n\n{output}"
-        )
-
         try:
-            # Run Gemini generation in a thread to avoid blocking the event loop
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model='gemini-3-flash-preview',
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    max_output_tokens=150,
-                    response_mime_type="application/json",
-                )
-            )
-
-            # Parse the content
-            content = response.text
-            if not content:
-                raise ValueError("Empty response from Gemini")
-                
-            # Clean markdown if present
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-                content = content.strip()
-                
-            data = json.loads(content)
-            chat_output = SilenceVoiceOutput(**data)
+            # identical transcripts share one Gemini call; the cached result is copied
+            # because the sentence ending and trailing space are added in place below
+            key = CorrectionCache.make_key(output, CORRECTION_PROMPT_VERSION)
+            chat_output = await self.correction_cache.get_or_compute(key, lambda: self.request_correction(output))
+            chat_output = chat_output.model_copy()
         except Exception as e:
             print(f"⚠️ Gemini correction failed: {e}")
             chat_output = SilenceVoiceOutput(
@@ -155,6 +148,35 @@ class SilenceVoice:
 
         return chat_output.corrected_text
 
+    async def request_correction(self, output):
+        prompt = CORRECTION_PROMPT + output
+
+        # Run Gemini generation in a thread to avoid blocking the event loop
+        response = await asyncio.to_thread(
+            self.client.models.generate_content,
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                max_output_tokens=150,
+                response_mime_type="application/json",
+            )
+        )
+
+        # Parse the content
+        content = response.text
+        if not content:
+            raise ValueError("Empty response from Gemini")
+            
+        # Clean markdown if present
+        if content.startswith("```"):
+            content = content.split("```")[1]
+            if content.startswith("json"):
+                content = content[4:]
+            content = content.strip()
+            
+        data = json.loads(content)
+        return SilenceVoiceOutput(**data)
+
     def perform_inference(self, video_path):
         # perform inference on the video with the vsr model
         output = self.vsr_model(video_path)